@@ -7,22 +7,27 @@
 # ///
 from __future__ import annotations
 
-import contextlib
 import dataclasses
 import io
 import re
 import shutil
 import subprocess
+import textwrap
 import typing
 from pathlib import Path
 import sys
 
 import click
-from fedrq.cli import main as fedrq_cli
 from ruamel.yaml import YAML
+from ruamel.yaml.composer import ComposerError
+
+from git_cache import GitObjectCache, sparse_checkout
+from pipeline import RecordWriter, read_packages
+from reverse_deps import ReverseDepGraph, get_index, get_rq
 
 # Constants
 PACKIT_YAML_REGEX = re.compile(r"\.?packit.ya?ml")
+PACKAGES_KEY_REGEX = re.compile(r"packages:[ \t]*(?P<value>[^#\s]*)[ \t]*(#.*)?$")
 
 # Variables for the lazy
 # You can add them manually here instead of passing via CLI
@@ -34,6 +39,12 @@ remove_paths = [
     "README*",
     "sources",
 ]
+git_cache_dir = None
+sparse = False
+depth = 1
+json_lines = False
+incremental = True
+repodata_index = True
 
 
 @dataclasses.dataclass
@@ -56,19 +67,127 @@ class PkgTemplate:
         }
 
 
+class PackitPackages:
+    """
+    The `packages` of a packit config, patched in place.
+
+    Only the lines of the `packages` mapping are scanned to index its keys and
+    an entry is only parsed when it is accessed. New entries are inserted as
+    text after the last entry and the file is replaced atomically right away,
+    so the rest of the file is left untouched and the progress is kept.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lines = path.read_text().splitlines(keepends=True)
+        # Entry -> (first line, end line)
+        self.entries: dict[str, tuple[int, int]] = {}
+        self.indent = 2
+        self._document = None
+        self._yaml = YAML(typ="rt")
+        self._index()
+
+    def _index(self) -> None:
+        for start, line in enumerate(self.lines):
+            if match := PACKAGES_KEY_REGEX.match(line):
+                break
+        else:
+            # Add an empty `packages` at the end
+            if self.lines and not self.lines[-1].endswith("\n"):
+                self.lines[-1] += "\n"
+            self.lines.append("packages:\n")
+            self.end = len(self.lines)
+            return
+        if match["value"] == "{}":
+            self.lines[start] = "packages:\n"
+        elif match["value"]:
+            raise ValueError(
+                f"Unsupported packages format in {self.path}, use --no-incremental"
+            )
+        self.end = start + 1
+        key = None
+        for i in range(start + 1, len(self.lines)):
+            line = self.lines[i]
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            indent = len(line) - len(line.lstrip(" "))
+            if not indent:
+                # Next top-level key
+                break
+            if key is None or indent <= self.indent:
+                self.indent = indent
+                if key is not None:
+                    self.entries[key] = (self.entries[key][0], self.end)
+                key = stripped.split(":", 1)[0].strip("\"'")
+                self.entries[key] = (i, i + 1)
+            self.end = i + 1
+        if key is not None:
+            self.entries[key] = (self.entries[key][0], self.end)
+
+    def __contains__(self, pkg: str) -> bool:
+        return pkg in self.entries
+
+    def __getitem__(self, pkg: str) -> dict[str, typing.Any]:
+        start, end = self.entries[pkg]
+        block = textwrap.dedent("".join(self.lines[start:end]))
+        try:
+            return YAML(typ="safe").load(block)[pkg]
+        except ComposerError:
+            # The entry uses anchors defined elsewhere in the document
+            if self._document is None:
+                self._document = YAML(typ="safe").load("".join(self.lines))
+            return self._document["packages"][pkg]
+
+    def __setitem__(self, pkg: str, data: dict[str, typing.Any]) -> None:
+        if pkg in self.entries:
+            if self[pkg] == data:
+                return
+            raise ValueError(
+                f"Only new entries can be added, {pkg} already has a different one"
+            )
+        stream = io.StringIO()
+        self._yaml.dump({pkg: data}, stream)
+        new_lines = textwrap.indent(stream.getvalue(), " " * self.indent)
+        new_lines = new_lines.splitlines(keepends=True)
+        self.lines[self.end : self.end] = new_lines
+        self.entries[pkg] = (self.end, self.end + len(new_lines))
+        self.end += len(new_lines)
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        tmp_path.write_text("".join(self.lines))
+        shutil.copymode(self.path, tmp_path)
+        tmp_path.replace(self.path)
+
+
 def configure_package(
-    pkg: str, workdir: Path, packit_data: dict[str, typing.Any]
+    pkg: str,
+    workdir: Path,
+    packit_packages: PackitPackages | dict[str, typing.Any],
+    git_cache: GitObjectCache | None = None,
+    sparse: bool = False,
+    stdout: typing.TextIO | None = None,
 ) -> None:
     # Add the appropriate `packages` field if missing
-    if pkg not in packit_data["packages"]:
-        packit_data["packages"][pkg] = PkgTemplate(pkg).to_dict()
+    if pkg not in packit_packages:
+        packit_packages[pkg] = PkgTemplate(pkg).to_dict()
     # Add the source from rawhide if not already present
-    dep_data = packit_data["packages"][pkg]
+    dep_data = packit_packages[pkg]
     dep_root = workdir / dep_data["paths"][0]
     specfile_path = dep_root / dep_data["specfile_path"]
     if not specfile_path.exists():
-        subprocess.call(["fedpkg", "clone", pkg], cwd=workdir)
         dep_path = workdir / pkg
+        if git_cache:
+            # Only check out the files that are kept, the history is not kept
+            # either so a shallow clone is enough
+            subprocess.call(
+                git_cache.clone_args(pkg, depth=1, sparse=sparse),
+                cwd=workdir,
+                stdout=stdout,
+            )
+            if sparse:
+                sparse_checkout(dep_path, remove_paths)
+        else:
+            subprocess.call(["fedpkg", "clone", pkg], cwd=workdir, stdout=stdout)
         for rm_pattern in remove_paths:
             for rm_path in dep_path.glob(rm_pattern):
                 if rm_path.is_dir():
@@ -110,7 +229,68 @@ def configure_package(
     multiple=True,
     default=skip,
 )
-def main(packages_file, workdir: Path, branch: str, skip: list[str]):
+@click.option(
+    "--git-cache",
+    "git_cache_dir",
+    help="""
+    Directory of a local git object cache used by the new clones.
+    """,
+    default=git_cache_dir,
+    type=click.Path(file_okay=False, path_type=Path),
+)
+@click.option(
+    "--sparse/--no-sparse",
+    help="""
+    Only check out the files that are not removed afterwards. Requires
+    `--git-cache`.
+    """,
+    default=sparse,
+)
+@click.option(
+    "--depth",
+    help="""
+    Depth of the reverse dependencies to add, e.g. 2 also adds the reverse
+    dependencies of the reverse dependencies. Use 0 for the full closure.
+    """,
+    default=depth,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--json-lines/--no-json-lines",
+    help="""
+    Write the added packages as JSON-lines records.
+    """,
+    default=json_lines,
+)
+@click.option(
+    "--incremental/--no-incremental",
+    help="""
+    Add the new packages to the packit config as soon as they are configured,
+    leaving the rest of the file untouched. Otherwise the whole file is loaded
+    and dumped back at the end.
+    """,
+    default=incremental,
+)
+@click.option(
+    "--repodata-index/--no-repodata-index",
+    help="""
+    Query a persistent index of the repodata of the branch, only rebuilt when
+    the repodata changes, instead of loading the repodata with fedrq.
+    """,
+    default=repodata_index,
+)
+def main(
+    packages_file,
+    workdir: Path,
+    branch: str,
+    skip: list[str],
+    git_cache_dir: Path | None,
+    sparse: bool,
+    depth: int,
+    json_lines: bool,
+    incremental: bool,
+    repodata_index: bool,
+):
     global packages, remove_paths
 
     for packit_file in workdir.iterdir():
@@ -119,35 +299,43 @@ def main(packages_file, workdir: Path, branch: str, skip: list[str]):
     else:
         raise FileNotFoundError("There is no .packit.yaml found")
 
-    if packages_file == "-":
-        if not sys.stdin.isatty():
-            packages = []
-            for pkg in sys.stdin:
-                packages.append(pkg.rstrip())
+    if sparse and not git_cache_dir:
+        raise click.UsageError("--sparse requires --git-cache")
+    git_cache = GitObjectCache(git_cache_dir) if git_cache_dir else None
+
+    if incremental:
+        try:
+            packit_packages = PackitPackages(packit_file)
+        except ValueError as exc:
+            raise click.ClickException(str(exc)) from exc
     else:
-        with Path(packages_file).open("r") as f:
-            packages = f.read().rstrip().split("\n")
+        packit_yaml = YAML(typ="rt")
+        packit_data = packit_yaml.load(packit_file)
+        packit_packages = packit_data["packages"]
 
-    packit_yaml = YAML(typ="rt")
-    packit_data = packit_yaml.load(packit_file)
+    out = RecordWriter(json_lines)
+    # Subprocesses must not write in the middle of the records
+    stdout = sys.stderr if json_lines else None
 
-    # First pass prepare the main packages
-    for pkg in packages:
-        configure_package(pkg, workdir, packit_data)
+    # First pass prepare the main packages as they are read
+    main_packages = []
+    for pkg in read_packages(packages_file, packages):
+        configure_package(pkg, workdir, packit_packages, git_cache, sparse, stdout)
+        out.emit(pkg, "add", depth=0)
+        main_packages.append(pkg)
 
     # Second pass prepare dependencies
-    for pkg in packages:
-        with contextlib.redirect_stdout(io.StringIO()) as f:
-            fedrq_cli(["wrsrc", pkg, "-F=source", f"-b={branch}"])
-        out = f.getvalue()
-        out: str
-        rev_deps = out.splitlines()
-        for dep in rev_deps:
-            if dep in packages or dep in skip:
-                continue
-            configure_package(dep, workdir, packit_data)
+    graph = ReverseDepGraph(get_index(branch) if repodata_index else get_rq(branch))
+    closure = graph.closure(main_packages, max_depth=depth or None, skip=skip)
+    for dep, dep_depth in closure.items():
+        if not dep_depth:
+            continue
+        out.echo(f"Adding {dep} (depth {dep_depth})")
+        configure_package(dep, workdir, packit_packages, git_cache, sparse, stdout)
+        out.emit(dep, "add", depth=dep_depth)
 
-    packit_yaml.dump(packit_data, packit_file)
+    if not incremental:
+        packit_yaml.dump(packit_data, packit_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,6 @@
+"""
+Local stand-in of the parts of the fedrq API used by the scripts.
+
+The repository is read from the JSON file pointed to by `FAKE_FEDRQ_REPO`,
+see `standins.write_fedrq_repo`.
+"""
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+from collections.abc import Iterable, Iterator
+
+
+@dataclasses.dataclass(frozen=True)
+class Package:
+    name: str
+    arch: str
+    version: str = "1.0"
+    release: str = "1.fc42"
+    source_name: str | None = None
+    requires: tuple[str, ...] = ()
+    provides: tuple[str, ...] = ()
+    files: tuple[str, ...] = ()
+
+
+class Query:
+    def __init__(self, packages: Iterable[Package]):
+        self._packages = frozenset(packages)
+
+    def __iter__(self) -> Iterator[Package]:
+        return iter(sorted(self._packages, key=lambda pkg: (pkg.name, pkg.arch)))
+
+    def __len__(self) -> int:
+        return len(self._packages)
+
+    def union(self, other: Query) -> Query:
+        return Query(self._packages | other._packages)
+
+    def filter(self, **kwargs) -> Query:
+        packages = self._packages
+        for key, value in kwargs.items():
+            match key:
+                case "latest":
+                    continue
+                case "name" | "arch":
+                    values = {value} if isinstance(value, str) else set(value)
+                    packages = {pkg for pkg in packages if getattr(pkg, key) in values}
+                case "requires" | "provides":
+                    if isinstance(value, Query):
+                        value = {prov for pkg in value for prov in pkg.provides}
+                    elif isinstance(value, str):
+                        value = {value}
+                    else:
+                        value = set(value)
+                    packages = {
+                        pkg for pkg in packages if value.intersection(getattr(pkg, key))
+                    }
+                case _:
+                    raise NotImplementedError(f"Unsupported filter: {key}")
+        return Query(packages)
+
+
+class Repoquery:
+    def __init__(self, packages: Iterable[Package]):
+        self._all = Query(packages)
+
+    def query(self, **kwargs) -> Query:
+        return self._all.filter(**kwargs)
+
+    def get_subpackages(self, packages: Query, **kwargs) -> Query:
+        names = {pkg.name for pkg in packages}
+        return Query(
+            pkg
+            for pkg in self._all
+            if pkg.arch != "src" and pkg.source_name in names
+        ).filter(**kwargs)
+
+
+class Config:
+    def get_rq(self, branch: str = "rawhide", *args, **kwargs) -> Repoquery:
+        with open(os.environ["FAKE_FEDRQ_REPO"]) as f:
+            data = json.load(f)
+        return Repoquery(
+            Package(
+                **{
+                    key: tuple(val) if isinstance(val, list) else val
+                    for key, val in pkg.items()
+                }
+            )
+            for pkg in data["packages"]
+        )
+
+
+def get_config(**overrides) -> Config:
+    return Config()
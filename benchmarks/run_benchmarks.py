@@ -0,0 +1,478 @@
+# /// script
+# dependencies = [
+#   "click",
+#   "copr",
+#   "python-bugzilla",
+#   "requests",
+#   "ruamel.yaml",
+#   "specfile",
+# ]
+# ///
+
+"""
+Measure the throughput of the scripts against local stand-ins.
+
+The external tools (fedpkg, rpmspec, spectool, rsync, git) are replaced by
+fake executables with a configurable latency, Copr, Bugzilla and the
+pagure_bz.json are served locally and fedrq is replaced by `fake_fedrq`.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import typing
+from pathlib import Path
+import sys
+
+import click
+
+from standins import (
+    FakeBugzilla,
+    FakeCopr,
+    StaticFiles,
+    write_fake_executables,
+    write_fedrq_repo,
+    write_packages,
+)
+
+# Constants
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+FAKE_FEDRQ_DIR = BENCH_DIR / "fake_fedrq"
+BUG_TITLE = "{package}: Fails to build with the benchmark change"
+BUG_BODY = "Benchmark bug for {package}, see {change_proposal}."
+
+
+@dataclasses.dataclass
+class Result:
+    script: str
+    packages: int
+    wall: float
+    cpu: float
+    max_rss: int
+    returncode: int
+
+
+@dataclasses.dataclass
+class Scenario:
+    """Everything needed to run a script on a prepared temporary directory."""
+
+    args: list[str]
+    cwd: Path
+    env: dict[str, str]
+    stdin: str = ""
+    # Check of the output of a successful run, returning the error if any
+    check: typing.Callable[[str], str | None] | None = None
+
+
+@dataclasses.dataclass
+class Context:
+    """The shared environment and stand-ins of all the scenarios."""
+
+    env: dict[str, str]
+    copr: FakeCopr
+    bugzilla: FakeBugzilla
+    files: StaticFiles
+    files_dir: Path
+    script_args: dict[str, list[str]]
+
+
+def run_measured(
+    scenario: Scenario, log_file: Path
+) -> tuple[float, float, int, int]:
+    """Run the scenario returning the wall time, CPU time, peak RSS and exit code."""
+    start = time.perf_counter()
+    with log_file.open("w") as log:
+        proc = subprocess.Popen(
+            [sys.executable, *scenario.args],
+            cwd=scenario.cwd,
+            env=scenario.env,
+            stdin=subprocess.PIPE,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        proc.stdin.write(scenario.stdin)
+        proc.stdin.close()
+        # wait4 gives us the resource usage of this process only
+        _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return (
+        wall,
+        rusage.ru_utime + rusage.ru_stime,
+        # ru_maxrss is in KiB on Linux
+        rusage.ru_maxrss * 1024,
+        proc.returncode,
+    )
+
+
+def set_script_variables(script: Path, dest: Path, **variables) -> None:
+    """Copy a script editing its user defined variables."""
+    text = script.read_text()
+    for name, value in variables.items():
+        text, count = re.subn(
+            rf"^{name}(: [^=]+)? = .*$",
+            f"{name} = {value!r}",
+            text,
+            count=1,
+            flags=re.MULTILINE,
+        )
+        if not count:
+            raise ValueError(f"Variable {name} not found in {script}")
+    dest.write_text(text)
+
+
+def prepare_update_downstream(
+    tmp: Path, packages: list[str], ctx: Context
+) -> Scenario:
+    workdir = tmp / "work"
+    downstream = tmp / "downstream"
+    downstream.mkdir()
+    write_packages(workdir, packages, ctx.files.url, ctx.files_dir)
+    return Scenario(
+        args=[
+            str(REPO_DIR / "update_downstream.py"),
+            f"--workdir={workdir}",
+            f"--downstream-dir={downstream}",
+            "--fas-id=bench",
+            *ctx.script_args.get("update_downstream", []),
+        ],
+        cwd=tmp,
+        env=ctx.env,
+        stdin="\n".join(packages) + "\n",
+    )
+
+
+def prepare_copr_rev_deps(tmp: Path, packages: list[str], ctx: Context) -> Scenario:
+    return Scenario(
+        args=[
+            str(REPO_DIR / "copr_rev_deps.py"),
+            "--project=bench/bench",
+            *ctx.script_args.get("copr_rev_deps", []),
+        ],
+        cwd=tmp,
+        env=ctx.env,
+        stdin="\n".join(packages) + "\n",
+    )
+
+
+def prepare_copr_rev_deps_flaky(
+    tmp: Path, packages: list[str], ctx: Context
+) -> Scenario:
+    scenario = prepare_copr_rev_deps(tmp, packages, ctx)
+    ctx.copr.submitted.clear()
+    # One failure of each kind, within the retries of a submission
+    ctx.copr.flaky_submissions = 3
+
+    def check(output: str) -> str | None:
+        names = [
+            json.loads(submitted["body"]).get("package_name")
+            for submitted in ctx.copr.submitted
+        ]
+        if ctx.copr.flaky_submissions:
+            return "The failed submissions were not retried"
+        if len(names) != len(set(names)):
+            return "Some builds were submitted more than once"
+        if "Failed to submit" in output:
+            return "Some builds were not submitted"
+        return None
+
+    scenario.check = check
+    return scenario
+
+
+def prepare_copr_failures(tmp: Path, packages: list[str], ctx: Context) -> Scenario:
+    ctx.copr.failed = packages
+    return Scenario(
+        args=[
+            str(REPO_DIR / "copr_failures.py"),
+            "--project=bench/bench",
+            *ctx.script_args.get("copr_failures", []),
+        ],
+        cwd=tmp,
+        env=ctx.env,
+    )
+
+
+def prepare_add_packit_reverse_deps(
+    tmp: Path, packages: list[str], ctx: Context
+) -> Scenario:
+    workdir = tmp / "packit"
+    workdir.mkdir()
+    (workdir / ".packit.yaml").write_text("# Benchmark packit config\npackages: {}\n")
+    return Scenario(
+        args=[
+            str(REPO_DIR / "add_packit_reverse_deps.py"),
+            f"--workdir={workdir}",
+            *ctx.script_args.get("add_packit_reverse_deps", []),
+        ],
+        cwd=tmp,
+        env=ctx.env,
+        stdin="\n".join(packages[: max(1, len(packages) // 10)]) + "\n",
+    )
+
+
+def prepare_create_bugzilla_bugs(
+    tmp: Path, packages: list[str], ctx: Context
+) -> Scenario:
+    ctx.copr.failed = packages
+    # Half of the packages already have a bug
+    ctx.bugzilla.bugs.clear()
+    for pkg in packages[::2]:
+        ctx.bugzilla._create(
+            {
+                "component": pkg,
+                "summary": BUG_TITLE.format(package=pkg),
+            }
+        )
+    script = tmp / "create_bugzilla_bugs.py"
+    set_script_variables(
+        REPO_DIR / "create_bugzilla_bugs.py",
+        script,
+        copr_project="bench/bench",
+        title=BUG_TITLE,
+        body=BUG_BODY,
+        change_proposal="https://example.invalid/change",
+        bugzilla_url=ctx.bugzilla.url,
+    )
+    return Scenario(
+        args=[str(script), *ctx.script_args.get("create_bugzilla_bugs", [])],
+        cwd=tmp,
+        env={
+            **ctx.env,
+            # The helper modules are imported from the repository
+            "PYTHONPATH": os.pathsep.join([str(REPO_DIR), ctx.env["PYTHONPATH"]]),
+        },
+    )
+
+
+def prepare_get_maintainers(
+    tmp: Path, packages: list[str], ctx: Context
+) -> Scenario:
+    return Scenario(
+        args=[
+            str(REPO_DIR / "get_maintainers.py"),
+            f"--url={ctx.files.url}/pagure_bz.json",
+            f"--cache-dir={tmp / 'cache'}",
+            *ctx.script_args.get("get_maintainers", []),
+        ],
+        cwd=tmp,
+        env=ctx.env,
+        stdin="\n".join(packages) + "\n",
+    )
+
+
+def prepare_get_maintainers_cached(
+    tmp: Path, packages: list[str], ctx: Context
+) -> Scenario:
+    cache_dir = tmp / "cache"
+    args = [
+        str(REPO_DIR / "get_maintainers.py"),
+        f"--url={ctx.files.url}/pagure_bz.json",
+        f"--cache-dir={cache_dir}",
+    ]
+    stdin = "\n".join(packages) + "\n"
+
+    def run(*extra_args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, *args, *extra_args],
+            cwd=tmp,
+            env=ctx.env,
+            input=stdin,
+            capture_output=True,
+            text=True,
+        )
+
+    offline_without_cache = run("--offline")
+    # Fill the cache so that the measured run only gets a 304 response
+    expected = run().stdout
+    ctx.files.responses.clear()
+
+    def check(output: str) -> str | None:
+        if not offline_without_cache.returncode:
+            return "--offline succeeded without a cache"
+        if ctx.files.responses != [("/pagure_bz.json", 304)]:
+            return f"The cache was not revalidated: {ctx.files.responses}"
+        with (cache_dir / "pagure_bz.meta.json").open() as f:
+            if not json.load(f).get("last_modified"):
+                return "The validators were not kept after a 304 response"
+        if output != expected:
+            return "The output differs when using the cache"
+        if run("--cache-ttl=0").stdout != expected:
+            return "The output differs when using the cache again"
+        if ctx.files.responses[1:] != [("/pagure_bz.json", 304)]:
+            return f"The cache was not revalidated again: {ctx.files.responses}"
+        offline = run("--offline")
+        if offline.returncode or offline.stdout != expected:
+            return "The output differs with --offline"
+        if len(ctx.files.responses) != 2:
+            return "--offline made a request"
+        return None
+
+    return Scenario(
+        args=[
+            *args,
+            # Always revalidate the cache
+            "--cache-ttl=0",
+            *ctx.script_args.get("get_maintainers_cached", []),
+        ],
+        cwd=tmp,
+        env=ctx.env,
+        stdin=stdin,
+        check=check,
+    )
+
+
+SCENARIOS: dict[str, typing.Callable[[Path, list[str], Context], Scenario]] = {
+    "update_downstream": prepare_update_downstream,
+    "copr_rev_deps": prepare_copr_rev_deps,
+    "copr_rev_deps_flaky": prepare_copr_rev_deps_flaky,
+    "copr_failures": prepare_copr_failures,
+    "add_packit_reverse_deps": prepare_add_packit_reverse_deps,
+    "create_bugzilla_bugs": prepare_create_bugzilla_bugs,
+    "get_maintainers": prepare_get_maintainers,
+    "get_maintainers_cached": prepare_get_maintainers_cached,
+}
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="10,100,1000",
+    help="""
+    Comma separated number of packages to run each script with.
+    """,
+)
+@click.option(
+    "--script",
+    "scripts",
+    type=click.Choice(list(SCENARIOS)),
+    multiple=True,
+    help="""
+    Scripts to benchmark, all of them by default.
+    """,
+)
+@click.option(
+    "--latency",
+    default=0.01,
+    help="""
+    Latency in seconds of each fake executable call and fake service request.
+    """,
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--script-args",
+    multiple=True,
+    help="""
+    Additional arguments for a script as `{script}={args}`,
+    e.g. `update_downstream=--jobs 8`.
+    """,
+)
+@click.option(
+    "--show-output",
+    is_flag=True,
+    help="""
+    Show the output of the scripts.
+    """,
+)
+@click.option(
+    "--output",
+    help="""
+    File where the results are written as JSON.
+    """,
+    type=click.Path(dir_okay=False, path_type=Path),
+)
+def main(
+    sizes: str,
+    scripts: tuple[str, ...],
+    latency: float,
+    script_args: tuple[str, ...],
+    show_output: bool,
+    output: Path | None,
+):
+    package_counts = [int(size) for size in sizes.split(",")]
+    scripts = scripts or tuple(SCENARIOS)
+    extra_args = {}
+    for item in script_args:
+        script, _, args = item.partition("=")
+        extra_args[script] = args.split()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="fedora-scripts-bench-") as tmp_root:
+        tmp_root = Path(tmp_root)
+        home = tmp_root / "home"
+        home.mkdir()
+        all_packages = [f"bench-pkg{i}" for i in range(max(package_counts))]
+        write_fedrq_repo(tmp_root / "fedrq_repo.json", all_packages)
+        files_dir = tmp_root / "files"
+        files_dir.mkdir()
+        with (files_dir / "pagure_bz.json").open("w") as f:
+            # The real file has many more packages than requested
+            json.dump(
+                {
+                    "rpms": {
+                        f"bench-pkg{i}": [f"maintainer{i % 97}", f"team{i % 13}"]
+                        for i in range(max(package_counts) * 10)
+                    }
+                },
+                f,
+            )
+        with (
+            FakeCopr(latency=latency) as copr,
+            FakeBugzilla(latency=latency) as bugzilla,
+            StaticFiles(files_dir, latency=latency) as files,
+        ):
+            copr.write_config(home)
+            spec_template = write_fake_executables(tmp_root / "bin", files.url)
+            env = {
+                **os.environ,
+                "HOME": str(home),
+                "PATH": os.pathsep.join([str(tmp_root / "bin"), os.environ["PATH"]]),
+                "PYTHONPATH": str(FAKE_FEDRQ_DIR),
+                "FAKE_FEDRQ_REPO": str(tmp_root / "fedrq_repo.json"),
+                "BENCH_LATENCY": str(latency),
+                "BENCH_SPEC_TEMPLATE": str(spec_template),
+            }
+            ctx = Context(env, copr, bugzilla, files, files_dir, extra_args)
+            click.echo(
+                f"{'script':<24}{'pkgs':>6}{'wall':>11}{'cpu':>10}{'peak RSS':>12}"
+            )
+            for script in scripts:
+                for count in package_counts:
+                    tmp = tmp_root / f"{script}-{count}"
+                    tmp.mkdir()
+                    scenario = SCENARIOS[script](tmp, all_packages[:count], ctx)
+                    log_file = tmp_root / f"{script}-{count}.log"
+                    wall, cpu, max_rss, returncode = run_measured(scenario, log_file)
+                    result = Result(script, count, wall, cpu, max_rss, returncode)
+                    results.append(result)
+                    click.echo(
+                        f"{script:<24}{count:>6}{wall:>10.2f}s{cpu:>9.2f}s"
+                        f"{max_rss / 2**20:>9.1f}MiB"
+                    )
+                    if returncode:
+                        click.secho(f"Exit code {returncode}:", fg="red", err=True)
+                        click.echo(log_file.read_text()[-2000:], err=True)
+                    elif scenario.check and (
+                        error := scenario.check(log_file.read_text())
+                    ):
+                        click.secho(f"Check failed: {error}", fg="red", err=True)
+                    elif show_output:
+                        click.echo(log_file.read_text(), err=True)
+                    shutil.rmtree(tmp)
+
+    if output:
+        with output.open("w") as f:
+            json.dump([dataclasses.asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+"""
+Local stand-ins of the external tools and services used by the scripts.
+"""
+
+from __future__ import annotations
+
+import datetime
+import functools
+import gzip
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+import xmlrpc.client
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+# A single script dispatching on the name it is called with. `BENCH_LATENCY`
+# is the time in seconds that each call takes.
+FAKE_EXECUTABLE = r"""#!/bin/bash
+sleep "${BENCH_LATENCY:-0}"
+name=$(basename "$0")
+pkg=$(basename "$PWD")
+case "$name" in
+  fedpkg)
+    case "$1" in
+      clone)
+        shift
+        while [[ "$1" == -* ]]; do shift; done
+        mkdir -p "$1"
+        printf 'SHA512 (%s-1.0.tar.gz) = 0\n' "$1" > "$1/sources"
+        sed "s/@NAME@/$1/g" "$BENCH_SPEC_TEMPLATE" > "$1/$1.spec"
+        ;;
+    esac
+    ;;
+  rsync)
+    args=()
+    for arg in "$@"; do [[ "$arg" == -* ]] || args+=("$arg"); done
+    cp -a "${args[0]}." "${args[1]}"
+    ;;
+  rpmspec)
+    echo -n "1.0"
+    ;;
+  spectool)
+    if [[ "$2" == "-l" ]]; then
+      echo "Source0: https://example.invalid/#/$pkg-1.0.tar.gz"
+    else
+      head -c 1024 /dev/urandom > "$pkg-1.0.tar.gz"
+    fi
+    ;;
+esac
+exit 0
+"""
+FAKE_EXECUTABLES = ["fedpkg", "rsync", "rpmspec", "rpmdev-bumpspec", "spectool", "git"]
+
+SPEC_TEMPLATE = """\
+Name:           @NAME@
+Version:        1.0
+Release:        1%{?dist}
+Summary:        Benchmark package @NAME@
+License:        MIT
+URL:            @URL@
+Source0:        %{url}/%{name}-%{version}.tar.gz
+
+%description
+Benchmark package.
+
+%changelog
+* Thu Jan 01 2026 Bench <bench@example.invalid> - 1.0-1
+- Initial package
+"""
+
+
+def write_fake_executables(bin_dir: Path, source_url: str) -> Path:
+    """
+    Write the fake executables in `bin_dir`, returning the spec template.
+
+    The sources of the packages are downloaded from `source_url`.
+    """
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    fake = bin_dir / "fake-tool"
+    fake.write_text(FAKE_EXECUTABLE)
+    fake.chmod(0o755)
+    for name in FAKE_EXECUTABLES:
+        (bin_dir / name).symlink_to(fake.name)
+    spec_template = bin_dir / "template.spec"
+    spec_template.write_text(SPEC_TEMPLATE.replace("@URL@", source_url))
+    return spec_template
+
+
+def write_packages(
+    workdir: Path,
+    packages: list[str],
+    source_url: str,
+    sources_dir: Path | None = None,
+) -> None:
+    """
+    Write a minimal updated package in `workdir` for each of the packages.
+
+    If `sources_dir` is given, the package sources are written there to be
+    served at `source_url`.
+    """
+    spec_template = SPEC_TEMPLATE.replace("@URL@", source_url)
+    for pkg in packages:
+        pkg_dir = workdir / pkg
+        pkg_dir.mkdir(parents=True, exist_ok=True)
+        (pkg_dir / f"{pkg}.spec").write_text(spec_template.replace("@NAME@", pkg))
+        if sources_dir:
+            source = sources_dir / f"{pkg}-1.0.tar.gz"
+            if not source.exists():
+                source.write_bytes(random.randbytes(1024))
+
+
+def write_fedrq_repo(path: Path, packages: list[str], seed: int = 0) -> None:
+    """
+    Write a repository for `fake_fedrq`.
+
+    Each source package has a main and a `-devel` subpackage. The source
+    packages build-require the `-devel` subpackages of a few earlier packages
+    and the main subpackages require their main dependencies.
+    """
+    rng = random.Random(seed)
+    repo = []
+    for i, pkg in enumerate(packages):
+        deps = rng.sample(packages[:i], min(i, 3))
+        repo.append(
+            {
+                "name": pkg,
+                "arch": "src",
+                "requires": [f"{dep}-devel" for dep in deps],
+                "provides": [pkg],
+            }
+        )
+        repo.append(
+            {
+                "name": pkg,
+                "arch": "x86_64",
+                "source_name": pkg,
+                "requires": deps,
+                "provides": [pkg],
+            }
+        )
+        repo.append(
+            {
+                "name": f"{pkg}-devel",
+                "arch": "x86_64",
+                "source_name": pkg,
+                "requires": [pkg],
+                "provides": [f"{pkg}-devel"],
+            }
+        )
+    with path.open("w") as f:
+        json.dump({"packages": repo}, f)
+
+
+class _StandIn:
+    """Run a server in a background thread while in the context."""
+
+    server: ThreadingHTTPServer
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StaticFiles(_StandIn):
+    """Serve the files of a directory, `responses` are the `(path, status)`."""
+
+    def __init__(self, directory: Path, latency: float = 0.0):
+        self.responses: list[tuple[str, int]] = []
+        files = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def log_request(self, code="-", size="-"):
+                files.responses.append((self.path, int(code)))
+
+            def send_head(self):
+                time.sleep(latency)
+                return super().send_head()
+
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            functools.partial(Handler, directory=str(directory)),
+        )
+
+
+# Last line of the build logs of the failed builds, by package
+FAILURE_LINES = [
+    "No matching package to install: 'python3dist(foo)'",
+    "foo.c:12:5: error: implicit declaration of function 'bar'",
+    "FAILED tests/test_foo.py::test_bar - AssertionError",
+    "Installed (but unpackaged) file(s) found:",
+    "Build timeout",
+]
+
+
+class FakeCopr(_StandIn):
+    """
+    Minimal Copr API: build submission, project package and build lists, build
+    chroots and their build logs.
+
+    `failed` are the packages whose latest build is failed in the project. The
+    next `flaky_submissions` build submissions fail in turn with a 503, a 429
+    or a dropped connection.
+    """
+
+    def __init__(self, failed: list[str] | None = None, latency: float = 0.0):
+        self.submitted: list[dict] = []
+        self.flaky_submissions = 0
+        self._failures = itertools.cycle([503, 429, "drop"])
+        self.builds: dict[int, dict] = {}
+        self._build_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.failed = failed or []
+        copr = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, data: dict, status: int = 200) -> None:
+                time.sleep(latency)
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _page(self, items: list, params: dict) -> dict:
+                offset = int(params.get("offset", 0))
+                limit = int(params.get("limit", len(items) or 1))
+                return {"items": items[offset : offset + limit], "meta": {}}
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                if url.path == "/api_3/package/list":
+                    latest = {}
+                    for build in copr.builds.values():
+                        latest[build["source_package"]["name"]] = build
+                    items = [
+                        {
+                            "name": name,
+                            "builds": {
+                                "latest": {"id": build["id"], "state": build["state"]}
+                            },
+                        }
+                        for name, build in sorted(latest.items())
+                    ]
+                    self._reply(self._page(items, params))
+                elif url.path == "/api_3/build/list":
+                    items = sorted(
+                        copr.builds.values(),
+                        key=lambda build: build["id"],
+                        reverse=params.get("order_type") == "DESC",
+                    )
+                    self._reply(self._page(items, params))
+                elif url.path == "/api_3/build-chroot/list":
+                    build = copr.builds.get(int(params["build_id"]))
+                    if build is None:
+                        self.send_error(404)
+                        return
+                    chroot = {
+                        "name": "fedora-rawhide-x86_64",
+                        "state": build["state"],
+                        "result_url": f"{copr.url}/results/{build['id']}/",
+                    }
+                    self._reply(self._page([chroot], params))
+                elif url.path.startswith("/results/"):
+                    build_id = int(url.path.split("/")[2])
+                    if build_id not in copr.builds:
+                        self.send_error(404)
+                        return
+                    time.sleep(latency)
+                    payload = copr.build_log(copr.builds[build_id])
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain")
+                    self.send_header("Content-Encoding", "gzip")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                elif url.path.startswith("/api_3/build/"):
+                    build_id = int(url.path.rsplit("/", 1)[1])
+                    if build_id in copr.builds:
+                        self._reply(copr.builds[build_id])
+                    else:
+                        self.send_error(404)
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode()
+                with copr._lock:
+                    failure = None
+                    if copr.flaky_submissions:
+                        copr.flaky_submissions -= 1
+                        failure = next(copr._failures)
+                if failure == "drop":
+                    time.sleep(latency)
+                    self.close_connection = True
+                    return
+                if failure:
+                    self._reply({"error": "Try again later"}, status=failure)
+                    return
+                try:
+                    name = json.loads(body).get("package_name")
+                except (ValueError, AttributeError):
+                    name = None
+                build = copr._add_build(name, "pending")
+                copr.submitted.append({"path": self.path, "body": body})
+                self._reply(build)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    @property
+    def failed(self) -> list[str]:
+        return sorted(
+            {
+                build["source_package"]["name"]
+                for build in self.builds.values()
+                if build["state"] == "failed"
+            }
+        )
+
+    @failed.setter
+    def failed(self, packages: list[str]) -> None:
+        with self._lock:
+            self.builds.clear()
+        for pkg in packages:
+            self._add_build(pkg, "failed")
+
+    def _add_build(self, package: str | None, state: str) -> dict:
+        with self._lock:
+            build = {
+                "id": next(self._build_ids),
+                "state": state,
+                "source_package": {"name": package},
+            }
+            self.builds[build["id"]] = build
+        return build
+
+    @staticmethod
+    def build_log(build: dict, lines: int = 20_000) -> bytes:
+        """Gzipped build log, ending with the failure of the failed builds."""
+        log = "".join(
+            f"{i}: Building {build['source_package']['name']}\n" for i in range(lines)
+        )
+        if build["state"] == "failed":
+            log += FAILURE_LINES[build["id"] % len(FAILURE_LINES)] + "\n"
+        return gzip.compress(log.encode(), compresslevel=1)
+
+    def write_config(self, home: Path) -> None:
+        config_file = home / ".config" / "copr"
+        config_file.parent.mkdir(parents=True, exist_ok=True)
+        config_file.write_text(
+            "[copr-cli]\n"
+            "login = bench\n"
+            "username = bench\n"
+            "token = bench\n"
+            f"copr_url = {self.url}\n"
+            "encrypted = False\n"
+        )
+
+
+class _ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class FakeBugzilla(_StandIn):
+    """
+    Minimal Bugzilla XML-RPC API: bug search, get and create.
+
+    `bugs` maps the component to the summary of its existing bug.
+    """
+
+    def __init__(self, bugs: dict[str, str] | None = None, latency: float = 0.0):
+        self.bugs: dict[int, dict] = {}
+        self._changed: dict[int, float] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.latency = latency
+        for component, summary in (bugs or {}).items():
+            self._create({"component": component, "summary": summary})
+
+        class Handler(SimpleXMLRPCRequestHandler):
+            rpc_paths = ("/xmlrpc.cgi",)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingXMLRPCServer(
+            ("127.0.0.1", 0),
+            requestHandler=Handler,
+            allow_none=True,
+            logRequests=False,
+        )
+        self.server.register_function(
+            lambda *args: {"version": "5.0"}, "Bugzilla.version"
+        )
+        self.server.register_function(self._user_get, "User.get")
+        self.server.register_function(self._bug_get, "Bug.get")
+        self.server.register_function(self._bug_search, "Bug.search")
+        self.server.register_function(self._bug_create, "Bug.create")
+
+    @property
+    def url(self) -> str:
+        return f"{super().url}/xmlrpc.cgi"
+
+    def _create(self, data: dict) -> dict:
+        with self._lock:
+            bug = {
+                "id": next(self._ids),
+                "status": "NEW",
+                "component": data["component"],
+                "summary": data["summary"],
+                "last_change_time": xmlrpc.client.DateTime(time.gmtime()),
+            }
+            self._changed[bug["id"]] = time.time()
+            self.bugs[bug["id"]] = bug
+        return bug
+
+    def _user_get(self, params: dict) -> dict:
+        time.sleep(self.latency)
+        return {"users": [{"id": 1, "name": "bench"}]}
+
+    def _bug_get(self, params: dict) -> dict:
+        time.sleep(self.latency)
+        ids = {int(bug_id) for bug_id in params.get("ids", [])}
+        return {"bugs": [bug for bug_id, bug in self.bugs.items() if bug_id in ids]}
+
+    def _bug_search(self, params: dict) -> dict:
+        time.sleep(self.latency)
+        bugs = list(self.bugs.values())
+        if "id" in params:
+            ids = {int(bug_id) for bug_id in params["id"]}
+            bugs = [bug for bug in bugs if bug["id"] in ids]
+        if "component" in params:
+            components = params["component"]
+            if isinstance(components, str):
+                components = [components]
+            bugs = [bug for bug in bugs if bug["component"] in components]
+        if "last_change_time" in params:
+            since = datetime.datetime.fromisoformat(
+                str(params["last_change_time"])
+            ).timestamp()
+            bugs = [bug for bug in bugs if self._changed[bug["id"]] >= since]
+        return {"bugs": bugs}
+
+    def _bug_create(self, params: dict) -> dict:
+        time.sleep(self.latency)
+        component = params["component"]
+        if isinstance(component, list):
+            component = component[0]
+        bug = self._create({"component": component, "summary": params["summary"]})
+        return {"id": bug["id"]}
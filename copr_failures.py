@@ -0,0 +1,120 @@
+# /// script
+# dependencies = [
+#   "click",
+#   "copr",
+#   "requests",
+# ]
+# ///
+
+"""
+Group the failed copr packages by the root cause found in their build logs.
+"""
+
+from __future__ import annotations
+
+import click
+from copr.v3 import Client
+
+from copr_logs import FailureClassifier, group_by_cause
+from copr_state import ProjectSnapshot
+from pipeline import RecordWriter, read_packages
+
+# Variables for the lazy
+# You can add them manually here instead of passing via CLI
+packages = []
+project = None
+jobs = 8
+causes = []
+json_lines = False
+
+
+@click.command()
+@click.option(
+    "--packages-file",
+    default="-",
+    help="""
+    A file with a list of packages to classify, by default all the failed
+    packages of the project. STDIN is used unless it is not open, in which case
+    the `packages` attribute of this file is used.
+    """,
+)
+@click.option(
+    "--project",
+    help="""
+    Copr project as {owner}/{project} format.
+    """,
+    default=project,
+)
+@click.option(
+    "--jobs",
+    "-j",
+    help="""
+    Number of build logs downloaded at the same time.
+    """,
+    default=jobs,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--cause",
+    "causes",
+    help="""
+    Only output the packages failing with this cause, e.g. `timeout`.
+    """,
+    multiple=True,
+    default=causes,
+)
+@click.option(
+    "--json-lines/--no-json-lines",
+    help="""
+    Write the failures as JSON-lines records instead of the groups, e.g. to
+    rebuild or report the packages of a group with the next script.
+    """,
+    default=json_lines,
+)
+def main(
+    packages_file,
+    project: str,
+    jobs: int,
+    causes: list[str],
+    json_lines: bool,
+):
+    if not project:
+        raise ValueError("No project was provided")
+
+    owner, project = project.split("/")
+    # Only connect once the arguments are validated
+    client = Client.create_from_config_file()
+
+    out = RecordWriter(json_lines)
+    snapshot = ProjectSnapshot(client, owner, project)
+    snapshot.update()
+    selected = list(read_packages(packages_file, packages)) or None
+    builds = {
+        pkg: snapshot.packages[pkg]["build_id"] for pkg in snapshot.failed(selected)
+    }
+    click.echo(f"Classifying {len(builds)} failed builds", err=True)
+
+    failures = []
+    for failure in FailureClassifier(client, jobs=jobs).classify(builds):
+        if causes and failure.cause not in causes:
+            continue
+        out.emit(
+            failure.package,
+            "failure",
+            build_id=failure.build_id,
+            cause=failure.cause,
+            chroot=failure.chroot,
+            line=failure.line,
+        )
+        failures.append(failure)
+
+    if json_lines:
+        return
+    for cause, cause_packages in group_by_cause(failures).items():
+        click.secho(f"{cause} ({len(cause_packages)}):", bold=True)
+        for pkg in cause_packages:
+            click.echo(f"  {pkg}")
+
+
+if __name__ == "__main__":
+    main()
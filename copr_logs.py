@@ -0,0 +1,283 @@
+"""
+Classification of the failed Copr builds by the root cause found in their logs.
+
+This is not a standalone script, the scripts using it must depend on `copr`
+and `requests`.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import dataclasses
+import hashlib
+import json
+import re
+import threading
+import typing
+import zlib
+from collections.abc import Iterable, Iterator, Mapping
+from pathlib import Path
+
+import requests
+from copr.v3 import CoprException
+
+from copr_state import CACHE_DIR
+
+if typing.TYPE_CHECKING:
+    from copr.v3 import Client
+
+LOG_NAME = "builder-live.log.gz"
+# Root cause -> patterns of a log line, by priority. The infrastructure failures
+# come first as they also break the later steps, the generic rpmbuild failure
+# is last. The patterns are searched through whole blocks of the log at once
+# (in multi-line mode), so they must not match across lines.
+SIGNATURES: dict[str, tuple[bytes, ...]] = {
+    "timeout": (rb"Build timeout", rb"Build step timed out"),
+    "out-of-memory": (
+        rb"Cannot allocate memory",
+        rb"virtual memory exhausted",
+        rb"Killed signal terminated program",
+        rb"fatal error: Killed",
+    ),
+    "missing-dependency": (
+        rb"No matching package to install: ",
+        rb"nothing provides .* needed by",
+        rb"Failed build dependencies:",
+    ),
+    "missing-source": (
+        rb"Bad file: .*: No such file or directory",
+        rb"Bad source: .*: No such file or directory",
+        rb"curl: \(\d+\) ",
+    ),
+    "patch-failed": (
+        rb"Hunk #\d+ FAILED",
+        rb"can't find file to patch",
+        rb"Patch #\d+ .*failed",
+    ),
+    "linker-error": (
+        rb"undefined reference to ",
+        rb"/ld: cannot find ",
+        rb"collect2: error: ",
+    ),
+    "compile-error": (
+        rb": error: ",
+        rb"error\[E\d+\]: ",
+        rb"error: could not compile ",
+        rb"CMake Error",
+    ),
+    "python-import": (rb"ModuleNotFoundError: ", rb"ImportError: "),
+    "test-failure": (
+        rb"FAILED ",
+        rb" failed(, .*)? in [\d.]+s =+$",
+        rb"Test suite failed",
+        rb"make(\[\d+\])?: \*\*\* \[[^\]\n]*(check|test)[^\]\n]*\]",
+    ),
+    "unpackaged-files": (rb"Installed \(but unpackaged\) file\(s\) found",),
+    "missing-files": (rb"File not found: ",),
+    "rpmbuild": (rb"RPM build errors:", rb"Bad exit status from "),
+}
+# Cause of the builds without a matching line
+UNKNOWN = "unknown"
+# Cause of the builds without a log (yet) or whose log could not be
+# downloaded, they are not cached
+NO_LOG = "no-log"
+UNAVAILABLE = "unavailable"
+
+
+def compile_signatures(
+    signatures: Mapping[str, Iterable[bytes]],
+) -> tuple[list[tuple[int, re.Pattern[bytes]]], list[str]]:
+    """Compile the signatures into a list of `(priority, pattern)` by priority."""
+    causes = list(signatures)
+    index = [
+        (priority, re.compile(pattern, re.MULTILINE))
+        for priority, cause in enumerate(causes)
+        for pattern in signatures[cause]
+    ]
+    return index, causes
+
+
+def signatures_digest(signatures: Mapping[str, Iterable[bytes]]) -> str:
+    """Digest of the signatures, the cached results are only valid for it."""
+    digest = hashlib.sha256()
+    for cause, patterns in signatures.items():
+        digest.update(cause.encode() + b"\0" + b"\0".join(patterns) + b"\0\0")
+    return digest.hexdigest()[:16]
+
+
+@dataclasses.dataclass
+class Failure:
+    package: str
+    build_id: int
+    cause: str
+    chroot: str | None = None
+    line: str | None = None
+
+
+def iter_gzip_blocks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Decompress a stream of (possibly) gzipped chunks into blocks of whole lines.
+    """
+    decompressor = None
+    rest = b""
+    for chunk in chunks:
+        if decompressor is None:
+            # Wait for the whole magic number
+            if len(rest + chunk) < 2:
+                rest += chunk
+                continue
+            chunk, rest = rest + chunk, b""
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                # The log is not compressed
+                decompressor = False
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+        block = rest + chunk
+        end = block.rfind(b"\n") + 1
+        rest = block[end:]
+        if end:
+            yield block[:end]
+    if decompressor:
+        rest += decompressor.flush()
+    if rest:
+        yield rest
+
+
+class FailureClassifier:
+    """
+    Classify the failed builds by matching their logs against `signatures`.
+
+    The logs of `jobs` builds are downloaded at the same time and they are
+    decompressed and matched block by block as they are received, so a log is
+    never held in memory. The cause with the highest priority found in a log
+    wins, so the download only stops early once a cause with the highest
+    priority of all is found. The results are cached by build ID as the logs
+    of a finished build do not change, but not the builds whose logs are not
+    available yet.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        jobs: int = 8,
+        path: Path | None = None,
+        signatures: Mapping[str, Iterable[bytes]] = SIGNATURES,
+        chunk_size: int = 64 * 1024,
+    ):
+        self.client = client
+        self.jobs = jobs
+        self.path = path or CACHE_DIR / "failures.json"
+        self.chunk_size = chunk_size
+        self.index, self.causes = compile_signatures(signatures)
+        self.digest = signatures_digest(signatures)
+        # Build ID -> {"cause": ..., "chroot": ..., "line": ...}
+        self.cache: dict[str, dict[str, typing.Any]] = {}
+        if self.path.exists():
+            with self.path.open("r") as f:
+                data = json.load(f)
+            if data.get("signatures") == self.digest:
+                self.cache = data["builds"]
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=jobs)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with self._lock, tmp_path.open("w") as f:
+            json.dump({"signatures": self.digest, "builds": self.cache}, f)
+        tmp_path.replace(self.path)
+
+    def match_blocks(self, blocks: Iterable[bytes]) -> tuple[str, str | None]:
+        """Get the cause with the highest priority and its first line."""
+        best = len(self.causes)
+        best_line = None
+        for block in blocks:
+            # Only the causes with a higher priority than the best one so far
+            # are searched, the lines are only split around a match
+            for priority, pattern in self.index:
+                if priority >= best:
+                    break
+                if match := pattern.search(block):
+                    best = priority
+                    start = block.rfind(b"\n", 0, match.start()) + 1
+                    end = block.find(b"\n", match.end())
+                    line = block[start : end if end >= 0 else None]
+                    best_line = line.decode(errors="replace").strip()
+            if not best:
+                break
+        if best_line is None:
+            return UNKNOWN, None
+        return self.causes[best], best_line
+
+    def log_urls(self, build_id: int) -> Iterator[tuple[str, str]]:
+        """Get the `(chroot, log URL)` of the failed chroots of a build."""
+        chroots = self.client.build_chroot_proxy.get_list(build_id)
+        for chroot in sorted(chroots, key=lambda chroot: chroot.name):
+            if chroot.state == "failed" and (result_url := chroot.get("result_url")):
+                yield chroot.name, f"{result_url.rstrip('/')}/{LOG_NAME}"
+
+    def classify_build(self, package: str, build_id: int) -> Failure:
+        cached = self.cache.get(str(build_id))
+        if cached is not None:
+            return Failure(package, build_id, **cached)
+        failure = Failure(package, build_id, NO_LOG)
+        try:
+            for chroot, url in self.log_urls(build_id):
+                with self.session.get(url, stream=True, timeout=60) as response:
+                    if response.status_code == 404:
+                        continue
+                    response.raise_for_status()
+                    # The logs may be served with a gzip encoding, keep them as-is
+                    chunks = response.raw.stream(
+                        self.chunk_size, decode_content=False
+                    )
+                    cause, line = self.match_blocks(iter_gzip_blocks(chunks))
+                failure = Failure(package, build_id, cause, chroot, line)
+                # The first failed chroot with a log is enough
+                break
+        except (CoprException, requests.RequestException, zlib.error) as exc:
+            return Failure(package, build_id, UNAVAILABLE, line=str(exc))
+        if failure.cause == NO_LOG:
+            # The logs may only be uploaded later
+            return failure
+        with self._lock:
+            self.cache[str(build_id)] = {
+                "cause": failure.cause,
+                "chroot": failure.chroot,
+                "line": failure.line,
+            }
+        return failure
+
+    def classify(self, builds: Mapping[str, int]) -> Iterator[Failure]:
+        """Classify the failed build of each package, as soon as it is done."""
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+                futures = [
+                    executor.submit(self.classify_build, package, build_id)
+                    for package, build_id in builds.items()
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    yield future.result()
+        finally:
+            # Keep the progress even if interrupted
+            self.save()
+
+
+def group_by_cause(failures: Iterable[Failure]) -> dict[str, list[str]]:
+    """Group the packages by cause, in the priority order of the causes."""
+    groups: dict[str, list[str]] = {}
+    for failure in failures:
+        groups.setdefault(failure.cause, []).append(failure.package)
+    order = [*SIGNATURES, UNKNOWN, NO_LOG, UNAVAILABLE]
+    return {
+        cause: sorted(groups[cause])
+        for cause in sorted(
+            groups,
+            key=lambda cause: order.index(cause) if cause in order else len(order),
+        )
+    }
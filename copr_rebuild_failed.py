@@ -1,6 +1,8 @@
 # /// script
 # dependencies = [
+#   "click",
 #   "copr",
+#   "requests",
 # ]
 # ///
 
@@ -10,38 +12,84 @@ Rebuild failed copr packages with the latest reference from rawhide.
 
 from __future__ import annotations
 
+import sys
+
 from copr.v3 import Client
 
+from copr_logs import FailureClassifier
+from copr_state import ProjectSnapshot
+from copr_submit import BuildSubmitter
+from pipeline import RecordWriter, read_packages
+
 # User-defined variables
 branch: str = "rawhide"
 project: str | None = None
 packages: list[str] = []
+# File with the packages, one per line or as JSON-lines records (`-` for STDIN)
+packages_file: str | None = None
+# Write the submitted builds as JSON-lines records
+json_lines: bool = False
+max_in_flight: int = 8
+rate: float = 5.0
+# Only rebuild the packages whose latest build changed since the last run
+only_changed: bool = False
+# Only rebuild the failed packages whose build log matches one of these causes
+# (see `copr_logs.SIGNATURES`), e.g. `["timeout", "out-of-memory"]`
+failure_causes: list[str] = []
 
-client = Client.create_from_config_file()
 owner, project = project.split("/")
+out = RecordWriter(json_lines)
+client = Client.create_from_config_file()
+snapshot = None
 
-if not packages:
+if packages_file:
+    packages = read_packages(packages_file)
+elif not packages:
     if not project:
         raise ValueError("No packages specified")
 
-    for pkg in client.package_proxy.get_list(
-        ownername=owner,
-        projectname=project,
-        with_latest_build=True,
-    ):
-        # TODO: Add a check to see if downstream has not been retired.
-        if pkg.builds["latest"]["state"] != "failed":
-            continue
-        packages.append(pkg.name)
-
-for pkg in packages:
-    print(f"Submitting re-build for: {pkg}")
-    client.build_proxy.create_from_distgit(
-        ownername=owner,
-        projectname=project,
-        packagename=pkg,
-        committish=branch,
-        buildopts={
-            "background": True,
-        },
+    snapshot = ProjectSnapshot(client, owner, project)
+    snapshot.update()
+    # The changes are tracked per script as the snapshot is shared
+    changed = snapshot.changes("copr_rebuild_failed")
+    # TODO: Add a check to see if downstream has not been retired.
+    packages = snapshot.failed(changed if only_changed else None)
+    if failure_causes:
+        builds = {pkg: snapshot.packages[pkg]["build_id"] for pkg in packages}
+        packages = sorted(
+            failure.package
+            for failure in FailureClassifier(client).classify(builds)
+            if failure.cause in failure_causes
+        )
+
+with BuildSubmitter(
+    client,
+    owner,
+    project,
+    max_in_flight=max_in_flight,
+    rate=rate,
+    on_result=lambda res: out.emit(
+        res.package,
+        "build",
+        build_id=res.build_id,
+        status=res.status,
+        error=res.error,
+    ),
+) as submitter:
+    # The packages are submitted as soon as they are read
+    for pkg in packages:
+        out.echo(f"Submitting re-build for: {pkg}")
+        submitter.submit(
+            pkg,
+            committish=branch,
+            buildopts={
+                "background": True,
+            },
+        )
+    results = submitter.report(file=sys.stderr if json_lines else None)
+
+if only_changed and snapshot is not None:
+    # The failed submissions are retried on the next run
+    snapshot.mark_consumed(
+        "copr_rebuild_failed", changed - {res.package for res in results if res.error}
     )
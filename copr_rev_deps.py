@@ -7,16 +7,21 @@
 # ///
 from __future__ import annotations
 
-import contextlib
-import io
-import subprocess
-from pathlib import Path
 import sys
 
 import click
-from fedrq.cli import main as fedrq_cli
 from copr.v3 import Client
 
+from copr_submit import BuildSubmitter
+from pipeline import RecordWriter, read_packages
+from reverse_deps import (
+    build_requires_graph,
+    get_index,
+    get_rq,
+    resolve_reverse_deps,
+    topological_layers,
+)
+
 # Variables for the lazy
 # You can add them manually here instead of passing via CLI
 packages = []
@@ -24,8 +29,11 @@ branch = "rawhide"
 skip = []
 project = None
 background = True
-
-client = Client.create_from_config_file()
+max_in_flight = 8
+rate = 5.0
+json_lines = False
+layers = True
+repodata_index = True
 
 
 @click.command()
@@ -67,40 +75,112 @@ client = Client.create_from_config_file()
     """,
     default=background,
 )
-def main(packages_file, branch: str, skip: list[str], project: str, background: bool):
-    global packages, client
+@click.option(
+    "--max-in-flight",
+    help="""
+    Maximum number of build submissions running at the same time.
+    """,
+    default=max_in_flight,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--rate",
+    help="""
+    Maximum number of build submissions per second.
+    """,
+    default=rate,
+    type=click.FloatRange(min=0, min_open=True),
+)
+@click.option(
+    "--json-lines/--no-json-lines",
+    help="""
+    Write the submitted builds as JSON-lines records instead of a summary.
+    """,
+    default=json_lines,
+)
+@click.option(
+    "--layers/--no-layers",
+    help="""
+    Submit the reverse dependencies in layers following their BuildRequires,
+    each layer as a Copr batch built after the previous one. This waits for all
+    the packages to be read, otherwise the builds of each package are submitted
+    as soon as it is read.
+    """,
+    default=layers,
+)
+@click.option(
+    "--repodata-index/--no-repodata-index",
+    help="""
+    Query a persistent index of the repodata of the branch, only rebuilt when
+    the repodata changes, instead of loading the repodata with fedrq.
+    """,
+    default=repodata_index,
+)
+def main(
+    packages_file,
+    branch: str,
+    skip: list[str],
+    project: str,
+    background: bool,
+    max_in_flight: int,
+    rate: float,
+    json_lines: bool,
+    layers: bool,
+    repodata_index: bool,
+):
+    global packages
 
     if not project:
         raise ValueError("No project was provided")
 
     owner, project = project.split("/")
+    # Only connect once the arguments are validated
+    client = Client.create_from_config_file()
 
-    if packages_file == "-":
-        if not sys.stdin.isatty():
-            packages = []
-            for pkg in sys.stdin:
-                packages.append(pkg.rstrip())
-    else:
-        with Path(packages_file).open("r") as f:
-            packages = f.read().rstrip().split("\n")
-
-    for pkg in packages:
-        with contextlib.redirect_stdout(io.StringIO()) as f:
-            fedrq_cli(["wrsrc", pkg, "-F=source", f"-b={branch}"])
-        out = f.getvalue()
-        out: str
-        rev_deps = out.splitlines()
-        for dep in rev_deps:
-            if dep == pkg or dep in skip:
-                continue
-            client.build_proxy.create_from_distgit(
-                ownername=owner,
-                projectname=project,
-                packagename=dep,
-                buildopts={
-                    "background": background,
-                }
-            )
+    out = RecordWriter(json_lines)
+    rq = get_index(branch) if repodata_index else get_rq(branch)
+    # Package -> index of its layer
+    layer_of = {}
+    with BuildSubmitter(
+        client,
+        owner,
+        project,
+        max_in_flight=max_in_flight,
+        rate=rate,
+        on_result=lambda res: out.emit(
+            res.package,
+            "build",
+            build_id=res.build_id,
+            status=res.status,
+            error=res.error,
+            layer=layer_of.get(res.package),
+        ),
+    ) as submitter:
+        buildopts = {
+            "background": background,
+        }
+        if layers:
+            main_packages = list(read_packages(packages_file, packages))
+            rev_deps = resolve_reverse_deps(main_packages, branch, rq)
+            deps = [
+                dep
+                for pkg in main_packages
+                for dep in rev_deps[pkg]
+                if dep not in skip
+            ]
+            dep_layers = topological_layers(build_requires_graph(deps, rq))
+            for i, layer in enumerate(dep_layers):
+                out.echo(f"Layer {i}: {len(layer)} packages")
+                layer_of.update(dict.fromkeys(layer, i))
+            submitter.submit_layers(dep_layers, buildopts=buildopts)
+        else:
+            # Submit the builds of each package as soon as it is read
+            for pkg in read_packages(packages_file, packages):
+                for dep in resolve_reverse_deps([pkg], branch, rq)[pkg]:
+                    if dep in skip:
+                        continue
+                    submitter.submit(dep, buildopts=buildopts)
+        submitter.report(file=sys.stderr if json_lines else None)
 
 
 if __name__ == "__main__":
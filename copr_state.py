@@ -0,0 +1,191 @@
+"""
+Incremental state of the packages of a Copr project shared by the scripts.
+
+This is not a standalone script, the scripts using it must depend on `copr`.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import typing
+from collections.abc import Iterator
+from pathlib import Path
+
+if typing.TYPE_CHECKING:
+    from copr.v3 import Client
+
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "fedora-scripts"
+    / "copr"
+)
+# Build states that do not change anymore
+FINISHED_STATES = {"succeeded", "failed", "canceled", "skipped", "forked"}
+
+
+class ProjectSnapshot:
+    """
+    Local snapshot of the latest build of each package of a Copr project.
+
+    The first update goes through the whole (paginated) package list. Later
+    updates only go through the builds newer than the last one seen, newest
+    first, and re-check the builds that were not finished yet. Only the
+    package name, build ID and state are kept.
+
+    The snapshot is shared by the scripts, so each of them keeps track of the
+    changes it consumed separately, see `changes` and `mark_consumed`.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        owner: str,
+        project: str,
+        path: Path | None = None,
+        page_size: int = 100,
+    ):
+        self.client = client
+        self.owner = owner
+        self.project = project
+        self.path = path or CACHE_DIR / owner / f"{project}.json"
+        self.page_size = page_size
+        # Package -> {"build_id": ..., "state": ...}
+        self.packages: dict[str, dict[str, typing.Any]] = {}
+        self.last_build_id = 0
+        if self.path.exists():
+            with self.path.open("r") as f:
+                data = json.load(f)
+            self.packages = data["packages"]
+            self.last_build_id = data["last_build_id"]
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            json.dump(
+                {"packages": self.packages, "last_build_id": self.last_build_id},
+                f,
+            )
+        tmp_path.replace(self.path)
+
+    def _pages(self, get_list: typing.Callable, **kwargs) -> Iterator:
+        offset = 0
+        while True:
+            page = get_list(
+                ownername=self.owner,
+                projectname=self.project,
+                pagination={"limit": self.page_size, "offset": offset, **kwargs},
+            )
+            yield from page
+            if len(page) < self.page_size:
+                return
+            offset += self.page_size
+
+    def iter_packages(self) -> Iterator[tuple[str, int | None, str | None]]:
+        """Stream the `(package, latest build ID, state)` of the whole project."""
+        for pkg in self._pages(
+            lambda **kwargs: self.client.package_proxy.get_list(
+                with_latest_build=True, **kwargs
+            )
+        ):
+            latest = (pkg.builds or {}).get("latest") or {}
+            yield pkg.name, latest.get("id"), latest.get("state")
+
+    def iter_new_builds(self) -> Iterator[tuple[str, int, str]]:
+        """Stream the `(package, build ID, state)` of the builds since the snapshot."""
+        # The last build ID is updated while the builds are recorded
+        last_build_id = self.last_build_id
+        for build in self._pages(
+            self.client.build_proxy.get_list,
+            order="id",
+            order_type="DESC",
+        ):
+            if build.id <= last_build_id:
+                return
+            source_package = build.source_package or {}
+            if name := source_package.get("name"):
+                yield name, build.id, build.state
+
+    def _record(self, name: str, build_id: int | None, state: str | None) -> bool:
+        current = self.packages.get(name)
+        if current and build_id is not None and current["build_id"] > build_id:
+            return False
+        if current == {"build_id": build_id, "state": state}:
+            return False
+        self.packages[name] = {"build_id": build_id, "state": state}
+        if build_id is not None:
+            self.last_build_id = max(self.last_build_id, build_id)
+        return True
+
+    def update(self) -> set[str]:
+        """Update the snapshot, returning the packages that changed."""
+        changed = set()
+        if not self.last_build_id:
+            for name, build_id, state in self.iter_packages():
+                if self._record(name, build_id, state):
+                    changed.add(name)
+        else:
+            # Builds that were still running can change state without a new build
+            unfinished = {
+                name: pkg["build_id"]
+                for name, pkg in self.packages.items()
+                if pkg["build_id"] is not None
+                and pkg["state"] not in FINISHED_STATES
+            }
+            for name, build_id, state in self.iter_new_builds():
+                if self._record(name, build_id, state):
+                    changed.add(name)
+            for name, build_id in unfinished.items():
+                if self.packages[name]["build_id"] != build_id:
+                    # Superseded by a newer build
+                    continue
+                build = self.client.build_proxy.get(build_id)
+                if self._record(name, build_id, build.state):
+                    changed.add(name)
+        self.save()
+        return changed
+
+    def _consumer_path(self, consumer: str) -> Path:
+        return self.path.with_name(f"{self.path.stem}.{consumer}.json")
+
+    def _consumed(self, consumer: str) -> dict[str, dict[str, typing.Any]]:
+        path = self._consumer_path(consumer)
+        if not path.exists():
+            return {}
+        with path.open("r") as f:
+            return json.load(f)
+
+    def changes(self, consumer: str) -> set[str]:
+        """Get the packages that changed since they were consumed by `consumer`."""
+        consumed = self._consumed(consumer)
+        return {
+            name for name, pkg in self.packages.items() if consumed.get(name) != pkg
+        }
+
+    def mark_consumed(
+        self, consumer: str, packages: typing.Iterable[str] | None = None
+    ) -> None:
+        """Mark the current state of `packages` (by default all) as consumed."""
+        consumed = self._consumed(consumer)
+        if packages is None:
+            packages = self.packages
+        for name in packages:
+            if name in self.packages:
+                consumed[name] = self.packages[name]
+        path = self._consumer_path(consumer)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            json.dump(consumed, f)
+        tmp_path.replace(path)
+
+    def failed(self, packages: typing.Iterable[str] | None = None) -> list[str]:
+        """Get the packages whose latest build failed, optionally within `packages`."""
+        if packages is None:
+            packages = self.packages
+        return sorted(
+            name
+            for name in packages
+            if self.packages.get(name, {}).get("state") == "failed"
+        )
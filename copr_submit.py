@@ -0,0 +1,312 @@
+"""
+Copr build submission engine shared by the scripts.
+
+This is not a standalone script, the scripts using it must depend on `copr`.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import dataclasses
+import threading
+import time
+import typing
+
+from copr.v3 import CoprException
+from copr.v3.exceptions import CoprRequestException, CoprTimeoutException
+
+if typing.TYPE_CHECKING:
+    from copr.v3 import Client
+
+# HTTP status codes for which a submission is retried
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Error of the builds not submitted as the build they depend on was not
+DEPENDENCY_ERROR = "Not submitted as the build it depends on could not be"
+
+
+class TokenBucket:
+    """Simple thread-safe token bucket rate limiter."""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclasses.dataclass
+class SubmitResult:
+    package: str
+    build_id: int | None = None
+    error: str | None = None
+
+    @property
+    def status(self) -> str:
+        return "failed" if self.error else "submitted"
+
+
+def _is_retryable(exc: CoprException) -> bool:
+    if isinstance(exc, CoprTimeoutException):
+        return True
+    status_code = _status_code(exc)
+    # Connection errors are wrapped without a response
+    if status_code is None:
+        return isinstance(exc, CoprRequestException)
+    return status_code in RETRY_STATUS
+
+
+def _status_code(exc: Exception) -> int | None:
+    response = getattr(exc, "response", None)
+    if response is None:
+        # CoprException keeps the response in its result
+        response = getattr(exc, "result", {}).get("__response__")
+    return getattr(response, "status_code", None)
+
+
+def _build_id(future: concurrent.futures.Future[SubmitResult]) -> int | None:
+    if future.exception() is not None:
+        return None
+    return future.result().build_id
+
+
+class BuildSubmitter:
+    """
+    Submit `create_from_distgit` builds concurrently.
+
+    At most `max_in_flight` requests are running at the same time and they are
+    rate-limited to `rate` requests per second. Requests failing with a
+    5xx/429 status or a connection error are retried with exponential backoff.
+    Each package is submitted at most once per submitter and `on_result` is
+    called with the result of each submission as soon as it is done.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        owner: str,
+        project: str,
+        max_in_flight: int = 8,
+        rate: float = 5.0,
+        retries: int = 5,
+        backoff: float = 1.0,
+        on_result: typing.Callable[[SubmitResult], None] | None = None,
+    ):
+        self.client = client
+        self.owner = owner
+        self.project = project
+        self.retries = retries
+        self.backoff = backoff
+        self.on_result = on_result
+        self.bucket = TokenBucket(rate)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_in_flight
+        )
+        self.futures: dict[str, concurrent.futures.Future[SubmitResult]] = {}
+
+    def __enter__(self) -> BuildSubmitter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # The chained submissions are only queued once their dependency is done
+        concurrent.futures.wait(list(self.futures.values()))
+        self.executor.shutdown(wait=True)
+
+    def _register(self, package: str) -> concurrent.futures.Future[SubmitResult]:
+        """Track the submission of `package`, whose result is set later."""
+        future = concurrent.futures.Future()
+        if self.on_result:
+            future.add_done_callback(lambda done: self.on_result(done.result()))
+        self.futures[package] = future
+        return future
+
+    def _queue(
+        self,
+        package: str,
+        committish: str | None,
+        buildopts: dict[str, typing.Any],
+        future: concurrent.futures.Future[SubmitResult],
+    ) -> None:
+        """Queue the submission of `package`, setting its result on `future`."""
+
+        def set_result(done: concurrent.futures.Future[SubmitResult]):
+            if (exc := done.exception()) is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(done.result())
+
+        done = self.executor.submit(self._submit, package, committish, buildopts)
+        done.add_done_callback(set_result)
+
+    def submit(
+        self,
+        package: str,
+        committish: str | None = None,
+        buildopts: dict[str, typing.Any] | None = None,
+        after: concurrent.futures.Future[SubmitResult] | None = None,
+        with_build: concurrent.futures.Future[SubmitResult] | None = None,
+    ) -> concurrent.futures.Future[SubmitResult]:
+        """
+        Queue a build of `package`, returning the existing one if already queued.
+
+        The build can be put in a Copr batch after the batch of the build of
+        `after`, or in the same batch as the build of `with_build`, in which
+        case it is only submitted once that build is submitted. If that build
+        could not be submitted, the build is not submitted either and fails.
+        """
+        if after is not None and with_build is not None:
+            raise ValueError("Only one of after and with_build can be used")
+        if package in self.futures:
+            return self.futures[package]
+        future = self._register(package)
+        buildopts = dict(buildopts or {})
+        dependency = after or with_build
+        if dependency is None:
+            self._queue(package, committish, buildopts, future)
+            return future
+        option = "after_build_id" if after else "with_build_id"
+
+        def submit_chained(done: concurrent.futures.Future[SubmitResult]):
+            if (build_id := _build_id(done)) is None:
+                # Submitting it anyway would silently lose the ordering
+                future.set_result(SubmitResult(package, error=DEPENDENCY_ERROR))
+            else:
+                self._queue(
+                    package, committish, {**buildopts, option: build_id}, future
+                )
+
+        dependency.add_done_callback(submit_chained)
+        return future
+
+    def submit_layers(
+        self,
+        layers: typing.Iterable[typing.Iterable[str]],
+        committish: str | None = None,
+        buildopts: dict[str, typing.Any] | None = None,
+    ) -> list[concurrent.futures.Future[SubmitResult]]:
+        """
+        Queue the builds of each layer of packages as a Copr batch, built after
+        the batch of the previous layer.
+
+        The first build of a layer is submitted after the batch of the previous
+        layer, then the other builds of the layer are submitted concurrently in
+        its batch. If the first build could not be submitted, the next one is
+        tried instead. If no build of a layer could be submitted, the builds of
+        the next layers fail instead of being submitted out of order.
+        """
+        buildopts = dict(buildopts or {})
+        futures = []
+        previous = None
+        for layer in layers:
+            packages = [pkg for pkg in dict.fromkeys(layer) if pkg not in self.futures]
+            if not packages:
+                continue
+            layer_futures = {pkg: self._register(pkg) for pkg in packages}
+            futures.extend(layer_futures.values())
+            first = concurrent.futures.Future()
+            self._submit_layer(layer_futures, first, previous, committish, buildopts)
+            previous = first
+        return futures
+
+    def _submit_layer(
+        self,
+        futures: dict[str, concurrent.futures.Future[SubmitResult]],
+        first: concurrent.futures.Future[SubmitResult],
+        after: concurrent.futures.Future[SubmitResult] | None,
+        committish: str | None,
+        buildopts: dict[str, typing.Any],
+    ) -> None:
+        """Submit a layer as a batch, `first` gets the build heading the batch."""
+
+        def try_first(packages: list[str], after_id: int | None):
+            package, *rest = packages
+            first_buildopts = dict(buildopts)
+            if after_id is not None:
+                first_buildopts["after_build_id"] = after_id
+
+            def first_done(done: concurrent.futures.Future[SubmitResult]):
+                if (build_id := _build_id(done)) is not None:
+                    first.set_result(done.result())
+                    for other in rest:
+                        self._queue(
+                            other,
+                            committish,
+                            {**buildopts, "with_build_id": build_id},
+                            futures[other],
+                        )
+                elif rest:
+                    try_first(rest, after_id)
+                else:
+                    first.set_result(SubmitResult(package, error=DEPENDENCY_ERROR))
+
+            self._queue(package, committish, first_buildopts, futures[package])
+            futures[package].add_done_callback(first_done)
+
+        def after_done(done: concurrent.futures.Future[SubmitResult]):
+            if (after_id := _build_id(done)) is None:
+                for package, future in futures.items():
+                    future.set_result(SubmitResult(package, error=DEPENDENCY_ERROR))
+                first.set_result(futures[next(iter(futures))].result())
+            else:
+                try_first(list(futures), after_id)
+
+        if after is None:
+            try_first(list(futures), None)
+        else:
+            after.add_done_callback(after_done)
+
+    def _submit(
+        self,
+        package: str,
+        committish: str | None,
+        buildopts: dict[str, typing.Any],
+    ) -> SubmitResult:
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                build = self.client.build_proxy.create_from_distgit(
+                    ownername=self.owner,
+                    projectname=self.project,
+                    packagename=package,
+                    committish=committish,
+                    buildopts=buildopts,
+                )
+                return SubmitResult(package, build_id=build.id)
+            except CoprException as exc:
+                if not _is_retryable(exc) or attempt >= self.retries:
+                    return SubmitResult(package, error=str(exc))
+                time.sleep(self.backoff * 2**attempt)
+                attempt += 1
+
+    def wait(self) -> list[SubmitResult]:
+        """Wait for all the submissions, returning them in submission order."""
+        return [future.result() for future in self.futures.values()]
+
+    def report(self, file: typing.TextIO | None = None) -> list[SubmitResult]:
+        """Wait for all the submissions and print a summary of them."""
+        results = self.wait()
+        failed = [res for res in results if res.error]
+        print(f"Submitted {len(results) - len(failed)} builds:", file=file)
+        for res in results:
+            if res.build_id is not None:
+                print(f"  {res.package}: {res.build_id}", file=file)
+        if failed:
+            print(f"Failed to submit {len(failed)} builds:", file=file)
+            for res in failed:
+                print(f"  {res.package}: {res.error}", file=file)
+        return results
@@ -1,7 +1,9 @@
 # /// script
 # dependencies = [
+#   "click",
 #   "copr",
 #   "bugzilla",
+#   "requests",
 # ]
 # ///
 
@@ -13,66 +15,210 @@ This is primarily built to help create blocking bugs for a change proposal.
 
 from __future__ import annotations
 
+import contextlib
+import datetime
+import functools
+import itertools
 import json
+import re
+import sqlite3
+from collections.abc import Iterable, Iterator
 from json import JSONDecodeError
 from pathlib import Path
 
 from copr.v3 import Client
 import bugzilla
 
+from copr_logs import FailureClassifier
+from copr_state import ProjectSnapshot
+from pipeline import RecordWriter, read_packages
+
 # User defined variables
 update_cahed_bugs: bool = True
+# Only refresh the cached bugs that changed since the last sync
+delta_sync: bool = True
+# Number of components or bugs requested per Bugzilla query
+query_batch_size: int = 200
 branch: str = "rawhide"
 packages: list[str] = []
+# File with the packages, one per line or as JSON-lines records (`-` for STDIN).
+# They are processed in batches as they are read.
+packages_file: str | None = None
+# Write the bug of each package as a JSON-lines record
+json_lines: bool = False
 copr_project: str | None = None
+# Only create bugs for the failed packages whose build log matches one of these
+# causes (see `copr_logs.SIGNATURES`), e.g. `["missing-dependency"]`
+failure_causes: list[str] = []
 title: str | None = None
 body: str | None = None
 change_proposal: str | None = None
 change_slug: str | None = None
 blocks_bgz: int | None = None
-
-copr_client = Client.create_from_config_file()
-bzapi = bugzilla.Bugzilla("bugzilla.redhat.com")
+bugzilla_url: str = "bugzilla.redhat.com"
 
 assert title
 assert body
 
-if not bzapi.logged_in:
-    raise ValueError("Invalid API key in ~/.config/python-bugzilla/bugzillarc ?")
+
+class BugCache:
+    """
+    Bugs of the packages for a title, in an SQLite database shared by all the
+    titles.
+
+    Each bug is committed on its own unless in a `transaction`. The database is
+    in WAL mode so that runs for different titles can use it at the same time.
+    Each bug keeps the time it was last synced with Bugzilla, so that only the
+    changes since then are queried, whichever run it was last seen in.
+    """
+
+    def __init__(self, path: Path, title: str):
+        self.title = title
+        # Transactions are handled explicitly
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS bugs (
+                title TEXT NOT NULL,
+                package TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                status TEXT,
+                synced TEXT,
+                PRIMARY KEY (title, package)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS imports (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL
+            );
+            """
+        )
+        self._in_transaction = False
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        if self._in_transaction:
+            yield
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._in_transaction = True
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        else:
+            self.conn.execute("COMMIT")
+        finally:
+            self._in_transaction = False
+
+    def import_json(self, json_file: Path) -> None:
+        """Import a JSON cache of the previous versions, once per modification."""
+        if not json_file.exists():
+            return
+        mtime = json_file.stat().st_mtime
+        row = self.conn.execute(
+            "SELECT mtime FROM imports WHERE path = ?", (str(json_file.resolve()),)
+        ).fetchone()
+        if row and row[0] == mtime:
+            return
+        with json_file.open("r") as f:
+            try:
+                data = json.load(f)
+            except JSONDecodeError:
+                data = None
+        with self.transaction():
+            if isinstance(data, dict):
+                # The imported bugs are fully refreshed once
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO bugs VALUES (?, ?, ?, ?, NULL)",
+                    (
+                        (title, pkg, bug["id"], bug["status"])
+                        for title, title_bugs in data.items()
+                        for pkg, bug in title_bugs.items()
+                    ),
+                )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO imports VALUES (?, ?)",
+                (str(json_file.resolve()), mtime),
+            )
+
+    def get(self, pkg: str) -> dict | None:
+        row = self.conn.execute(
+            "SELECT id, status, synced FROM bugs WHERE title = ? AND package = ?",
+            (self.title, pkg),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "status": row[1], "synced": row[2]}
+
+    def __contains__(self, pkg: str) -> bool:
+        return self.get(pkg) is not None
+
+    def __getitem__(self, pkg: str) -> dict:
+        if (bug := self.get(pkg)) is None:
+            raise KeyError(pkg)
+        return bug
+
+    def __setitem__(self, pkg: str, bug: dict) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO bugs VALUES (?, ?, ?, ?, ?)",
+            (self.title, pkg, bug["id"], bug["status"], bug.get("synced")),
+        )
+
+    def mark_synced(self, pkgs: Iterable[str], time: str) -> None:
+        self.conn.executemany(
+            "UPDATE bugs SET synced = ? WHERE title = ? AND package = ?",
+            ((time, self.title, pkg) for pkg in pkgs),
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# The clients are only created when they are first needed
+@functools.cache
+def get_copr_client() -> Client:
+    return Client.create_from_config_file()
+
+
+@functools.cache
+def get_bzapi() -> bugzilla.Bugzilla:
+    bzapi = bugzilla.Bugzilla(bugzilla_url)
+    if not bzapi.logged_in:
+        raise ValueError("Invalid API key in ~/.config/python-bugzilla/bugzillarc ?")
+    return bzapi
+
 
 copr_owner, copr_project = copr_project.split("/")
+out = RecordWriter(json_lines)
 
-if not packages:
+if packages_file:
+    packages = read_packages(packages_file)
+elif not packages:
     if not copr_project:
         raise ValueError("No packages specified")
 
-    for pkg in copr_client.package_proxy.get_list(
-        ownername=copr_owner,
-        projectname=copr_project,
-        with_latest_build=True,
-    ):
-        if pkg.builds["latest"]["state"] != "failed":
-            continue
-        packages.append(pkg.name)
-
-# Read/Write cache of the presence of the bugzilla bugs
-cache_file = Path("create_bugzilla_bugs_cache.json")
-cache_file.touch()
-with cache_file.open("r") as f:
-    try:
-        cache_file_data = json.load(f)
-    except JSONDecodeError:
-        cache_file_data = None
-if not cache_file_data:
-    cache_file_data = {}
-assert isinstance(cache_file_data, dict)
-cache_data = cache_file_data.setdefault(
-    title.format(
-        package="{package}",
-        change_proposal=change_proposal,
-    ),
-    {},
+    snapshot = ProjectSnapshot(get_copr_client(), copr_owner, copr_project)
+    snapshot.update()
+    packages = snapshot.failed()
+    if failure_causes:
+        builds = {pkg: snapshot.packages[pkg]["build_id"] for pkg in packages}
+        packages = sorted(
+            failure.package
+            for failure in FailureClassifier(get_copr_client()).classify(builds)
+            if failure.cause in failure_causes
+        )
+
+cache_key = title.format(
+    package="{package}",
+    change_proposal=change_proposal,
 )
+# Read/Write cache of the presence of the bugzilla bugs, shared by all the titles
+cache_data = BugCache(Path("create_bugzilla_bugs_cache.sqlite"), cache_key)
+# Cache of the previous versions of this script
+cache_data.import_json(Path("create_bugzilla_bugs_cache.json"))
 
 bug_state = {
     "NEW": [],
@@ -81,15 +227,94 @@ bug_state = {
 }
 
 
+BUG_FIELDS = ["id", "status", "component", "summary", "last_change_time"]
+
+
 def cache_bug(pkg: str, bug: bugzilla.base.Bug) -> None:
-    global cache_data, cache_file_data, cache_file
+    global cache_data
 
     cache_data[pkg] = {
         "id": bug.id,
         "status": bug.status if hasattr(bug, "status") else None,
+        "synced": sync_time,
     }
-    with cache_file.open("w") as f:
-        json.dump(cache_file_data, f)
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+
+def refresh_cached_bugs(pkgs: list[str]) -> None:
+    """Refresh the status of the cached bugs of `pkgs` in as few queries as possible."""
+    global cache_data
+
+    # The bugs synced at the same time are queried together
+    pkg_by_id_by_sync = {}
+    for pkg in pkgs:
+        bug = cache_data[pkg]
+        last_sync = bug["synced"] if delta_sync else None
+        pkg_by_id_by_sync.setdefault(last_sync, {})[bug["id"]] = pkg
+    for last_sync, pkg_by_id in pkg_by_id_by_sync.items():
+        for bug_ids in batched(pkg_by_id, query_batch_size):
+            if last_sync:
+                # Only get the bugs that changed since they were last synced
+                bugs = get_bzapi().query(
+                    {
+                        "id": bug_ids,
+                        "last_change_time": last_sync,
+                        "include_fields": BUG_FIELDS,
+                    }
+                )
+            else:
+                bugs = get_bzapi().getbugs(bug_ids, include_fields=BUG_FIELDS)
+            with cache_data.transaction():
+                for bug in bugs:
+                    if bug is None:
+                        continue
+                    cache_bug(pkg_by_id[bug.id], bug)
+                # The unchanged bugs are up to date as well
+                cache_data.mark_synced(
+                    (pkg_by_id[bug_id] for bug_id in bug_ids), sync_time
+                )
+
+
+def title_words(curr_title: str) -> list[str]:
+    # Bugzilla splits the `allwordssubstr` searches on whitespace and commas
+    return [word for word in re.split(r"[\s,]+", curr_title) if word]
+
+
+def title_matches(curr_title: str, bug: bugzilla.base.Bug) -> bool:
+    # Same as the `allwordssubstr` matching of `short_desc`: every word is a
+    # case-insensitive substring of the summary
+    summary = bug.summary.casefold()
+    return all(word.casefold() in summary for word in title_words(curr_title))
+
+
+def find_existing_bugs(pkgs: list[str]) -> dict[str, list[bugzilla.base.Bug]]:
+    """Search the bugs of all `pkgs` with multi-component queries."""
+    # Narrow down the query with the parts of the title common to all packages
+    common_title = title.format(package="", change_proposal=change_proposal).strip()
+    found = {}
+    for components in batched(pkgs, query_batch_size):
+        query = get_bzapi().build_query(
+            product="Fedora",
+            component=components,
+            version=branch,
+            short_desc=common_title or None,
+            include_fields=BUG_FIELDS,
+        )
+        if common_title:
+            # The local `title_matches` mirrors this matching on the full title,
+            # whose words contain the ones of the common title
+            query["short_desc_type"] = "allwordssubstr"
+        for bug in get_bzapi().query(query):
+            pkg = bug.component
+            curr_title = title.format(package=pkg, change_proposal=change_proposal)
+            if pkg in components and title_matches(curr_title, bug):
+                found.setdefault(pkg, []).append(bug)
+    return found
 
 
 def check_bug_state(pkg: str) -> None:
@@ -101,7 +326,7 @@ def check_bug_state(pkg: str) -> None:
     # Rebuild if issue was closed. The initial filter should not be adding
     # the package to the list if the package was not failing.
     if cache_data[pkg]["status"] == "CLOSED":
-        copr_client.build_proxy.create_from_distgit(
+        get_copr_client().build_proxy.create_from_distgit(
             ownername=copr_owner,
             projectname=copr_project,
             packagename=pkg,
@@ -112,59 +337,79 @@ def check_bug_state(pkg: str) -> None:
         )
 
 
-for pkg in packages:
+def emit_bug(pkg: str, source: str) -> None:
+    out.emit(
+        pkg,
+        "bug",
+        bug_id=cache_data[pkg]["id"],
+        status=cache_data[pkg]["status"],
+        source=source,
+    )
+
+
+def process_packages(pkgs: list[str]) -> None:
     # Check the presence in cache file first
-    if pkg in cache_data:
-        if update_cahed_bugs:
-            bug = bzapi.getbug(cache_data[pkg]["id"])
+    cached_packages = [pkg for pkg in pkgs if pkg in cache_data]
+    if update_cahed_bugs and cached_packages:
+        refresh_cached_bugs(cached_packages)
+    # Check if bugs were already opened for the other packages
+    existing_bugs = find_existing_bugs([pkg for pkg in pkgs if pkg not in cache_data])
+
+    for pkg in pkgs:
+        if pkg in cache_data:
+            check_bug_state(pkg)
+            out.echo(f"Bug for {pkg} found in cache: {cache_data[pkg]['status']}")
+            emit_bug(pkg, "cached")
+            continue
+
+        # Otherwise search or create the bug
+        curr_title = title.format(
+            package=pkg,
+            change_proposal=change_proposal,
+        )
+
+        if bugs := existing_bugs.get(pkg):
+            if len(bugs) > 1:
+                out.echo(f"Warning, {pkg} has more than 1 bug matching.")
+            bug = bugs[0]
             cache_bug(pkg, bug)
-        check_bug_state(pkg)
-        print(f"Bug for {pkg} found in cache: {cache_data[pkg]['status']}")
-        continue
-
-    # Otherwise search or create the bug
-    curr_title = title.format(
-        package=pkg,
-        change_proposal=change_proposal,
-    )
+            check_bug_state(pkg)
+            out.echo(f"Bug for {pkg} already exists: Cached result")
+            emit_bug(pkg, "found")
+            continue
 
-    # Check if a bug was already opened
-    query = bzapi.build_query(
-        product="Fedora",
-        component=pkg,
-        version=branch,
-        short_desc=curr_title,
-    )
-    bugs = bzapi.query(query)
-    if bugs:
-        if len(bugs) > 1:
-            print(f"Warning, {pkg} has more than 1 bug matching.")
-        bug = bugs[0]
-        cache_bug(pkg, bug)
-        check_bug_state(pkg)
-        print(f"Bug for {pkg} already exists: Cached result")
-        continue
-
-    # Otherwise create the bug
-    print(f"Creating bug for {pkg}")
-    bug = bzapi.createbug(
-        bzapi.build_createbug(
-            product="Fedora",
-            component=pkg,
-            version=branch,
-            summary=curr_title,
-            description=body.format(
-                package=pkg,
-                change_proposal=change_proposal,
-                copr_owner=copr_owner,
-                copr_project=copr_project,
-                change_slug=change_slug,
-            ),
-            blocks=blocks_bgz,
+        # Otherwise create the bug
+        out.echo(f"Creating bug for {pkg}")
+        bug = get_bzapi().createbug(
+            get_bzapi().build_createbug(
+                product="Fedora",
+                component=pkg,
+                version=branch,
+                summary=curr_title,
+                description=body.format(
+                    package=pkg,
+                    change_proposal=change_proposal,
+                    copr_owner=copr_owner,
+                    copr_project=copr_project,
+                    change_slug=change_slug,
+                ),
+                blocks=blocks_bgz,
+            )
         )
-    )
-    cache_bug(pkg, bug)
+        cache_bug(pkg, bug)
+        emit_bug(pkg, "created")
+
+
+# Time at which the bugs are synced by this run. Bugzilla timestamps are in UTC,
+# leave some margin for clock skew.
+sync_time = (
+    datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=5)
+).strftime("%Y-%m-%dT%H:%M:%SZ")
+# The packages are read lazily, each batch is processed as soon as it is complete
+for batch in batched(packages, query_batch_size):
+    process_packages(batch)
+cache_data.close()
 
-print("Overview:")
+out.echo("Overview:")
 for status, bug_packages in bug_state.items():
-    print(f"Status {status}: {len(bug_packages)}")
+    out.echo(f"Status {status}: {len(bug_packages)}")
@@ -0,0 +1,100 @@
+# /// script
+# dependencies = [
+#   "click",
+#   "copr",
+#   "fedrq",
+#   "python-bugzilla",
+#   "requests",
+#   "ruamel.yaml",
+#   "specfile",
+# ]
+# ///
+
+"""
+All the scripts as subcommands of a single entry point.
+
+The script of a subcommand is only imported when that subcommand is run, so
+listing the commands does not import any of the heavy dependencies.
+"""
+
+from __future__ import annotations
+
+import importlib
+import runpy
+
+import click
+
+# Subcommand -> (module, click command of the module, short help). The modules
+# without a command are configured by editing their variables and are run
+# as-is.
+COMMANDS: dict[str, tuple[str, str | None, str]] = {
+    "add-packit-reverse-deps": (
+        "add_packit_reverse_deps",
+        "main",
+        "Add new reverse dependencies for a packit project.",
+    ),
+    "copr-failures": (
+        "copr_failures",
+        "main",
+        "Group the failed copr packages by the root cause found in their build logs.",
+    ),
+    "copr-rebuild-failed": (
+        "copr_rebuild_failed",
+        None,
+        "Rebuild failed copr packages with the latest reference from rawhide.",
+    ),
+    "copr-rev-deps": ("copr_rev_deps", "main", "Do impact check in copr."),
+    "create-bugzilla-bugs": (
+        "create_bugzilla_bugs",
+        None,
+        "Create bugzilla bugs for failing copr project builds.",
+    ),
+    "get-maintainers": ("get_maintainers", "main", "Get the package maintainers."),
+    "update-downstream": (
+        "update_downstream",
+        "main",
+        "rsync and push multiple package updates from a local working environment.",
+    ),
+    "update-rust-packages": (
+        "update_rust_packages",
+        "main",
+        "Update rust packages with rust2rpm.",
+    ),
+}
+
+
+class LazyGroup(click.Group):
+    """Group importing the module of a subcommand only when it is needed."""
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(COMMANDS)
+
+    def get_command(self, ctx: click.Context, name: str) -> click.Command | None:
+        if name not in COMMANDS:
+            return None
+        module, attr, short_help = COMMANDS[name]
+        if attr is None:
+            return click.Command(
+                name,
+                callback=lambda: runpy.run_module(module, run_name="__main__"),
+                help=f"{short_help} Edit the variables of {module}.py to use it.",
+            )
+        return getattr(importlib.import_module(module), attr)
+
+    def format_commands(
+        self, ctx: click.Context, formatter: click.HelpFormatter
+    ) -> None:
+        # Use the static help so that the modules are not imported
+        with formatter.section("Commands"):
+            formatter.write_dl(
+                [(name, short_help) for name, (_, _, short_help) in COMMANDS.items()]
+            )
+
+
+@click.group(cls=LazyGroup)
+def main():
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -6,22 +6,283 @@
 # ///
 
 import json
+import os
+import sqlite3
+import tempfile
+import time
+import typing
+from collections.abc import Iterable, Iterator
 from pathlib import Path
-import sys
 
 import click
 import requests
 
+from pipeline import RecordWriter, read_packages
+
 # Constants
 MAINTAINERS_URL = "https://src.fedoraproject.org/extras/pagure_bz.json"
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "fedora-scripts"
+)
 
 # Variables for the lazy
 # You can add
 packages = []
+cache_ttl = 3600
+
+
+def fetch_maintainers_index(
+    url: str,
+    cache_dir: Path,
+    ttl: float,
+    offline: bool = False,
+) -> Path:
+    """
+    Get the index of the `pagure_bz.json` from `url`, going through a local
+    cache.
+
+    The index of each download is stored next to the validators of the
+    response (`ETag`/`Last-Modified`) so that the file is only downloaded and
+    indexed again when it changed. The cache is used as-is if it is younger
+    than `ttl` seconds, otherwise it is revalidated with a conditional request.
+    """
+    index_file = cache_dir / "pagure_bz.sqlite"
+    meta_file = cache_dir / "pagure_bz.meta.json"
+    meta = {}
+    if index_file.exists() and meta_file.exists():
+        with meta_file.open("r") as f:
+            meta = json.load(f)
+        if meta.get("url") != url:
+            meta = {}
+
+    if offline:
+        if not meta:
+            raise click.ClickException(f"No cached data available for {url}")
+        return index_file
+
+    if meta and time.time() - meta["fetched"] < ttl:
+        return index_file
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    with requests.get(url, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        if response.status_code != 304:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(
+                prefix=".pagure_bz.", suffix=".json", dir=cache_dir
+            )
+            data_file = Path(tmp_name)
+            try:
+                with open(fd, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        f.write(chunk)
+                MaintainersIndex.build(index_file, data_file)
+            finally:
+                data_file.unlink(missing_ok=True)
+    if response.status_code == 304:
+        # The validators are not necessarily sent again
+        meta["fetched"] = time.time()
+    else:
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched": time.time(),
+        }
+    with meta_file.open("w") as f:
+        json.dump(meta, f)
+    return index_file
+
+
+class JSONStream:
+    """
+    Minimal incremental reader of a JSON document.
+
+    Only the structure of the objects being iterated is parsed by hand, each
+    key and value is decoded on its own so that the values that are not kept
+    can be dropped right away.
+    """
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, f: typing.TextIO, chunk_size: int = 1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def _fill(self, size: int | None = None) -> bool:
+        chunk = self.f.read(size or self.chunk_size)
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of the JSON document")
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars!r}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self) -> typing.Any:
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                end = None
+            # A number could continue in the next chunk
+            if end is not None and end < len(self.buffer):
+                self.pos = end
+                return value
+            if not self._fill(size):
+                if end is None:
+                    raise ValueError("Invalid JSON document")
+                self.pos = end
+                return value
+            # Large values need larger reads not to be decoded too many times
+            size *= 2
+
+    def keys(self) -> Iterator[str]:
+        """
+        Iterate over the keys of the object at the current position. The value
+        of each key must be read before getting the next key.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+
+def iter_package_maintainers(data_file: Path) -> Iterator[tuple[str, list[str]]]:
+    """Stream the `rpms` maintainers of a `pagure_bz.json` file."""
+    with data_file.open("r") as f:
+        stream = JSONStream(f)
+        for key in stream.keys():
+            if key != "rpms":
+                stream.value()
+                continue
+            for pkg in stream.keys():
+                yield pkg, stream.value()
+
+
+class MaintainersIndex:
+    """
+    Index of the `rpms` maintainers of a `pagure_bz.json` file, in an SQLite
+    database.
+
+    It is built once per download by streaming the file, then the packages of
+    a maintainer and the maintainers of a package are looked up without
+    decoding the file again.
+    """
+
+    SCHEMA = """
+        CREATE TABLE maintainers (
+            package TEXT NOT NULL,
+            maintainer TEXT NOT NULL,
+            -- Positions of the package in the file and of the maintainer in
+            -- the list of the package
+            package_position INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (package, maintainer)
+        ) WITHOUT ROWID;
+        """
+    # Created once the table is filled
+    INDEXES = """
+        CREATE INDEX maintainer_packages
+            ON maintainers (maintainer, package_position);
+        """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
 
-# Get all package maintainers
-response = requests.get(MAINTAINERS_URL)
-all_package_maintainers = response.json()["rpms"]
+    @classmethod
+    def build(cls, path: Path, data_file: Path) -> None:
+        """Build the index of `data_file` at `path`, replacing it."""
+        fd, tmp_name = tempfile.mkstemp(
+            prefix=f".{path.name}.", suffix=".tmp", dir=path.parent
+        )
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # The file is only used once it is complete
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.executescript(cls.SCHEMA)
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO maintainers VALUES (?, ?, ?, ?)",
+                    (
+                        (pkg, maintainer, package_position, position)
+                        for package_position, (pkg, maintainers) in enumerate(
+                            iter_package_maintainers(data_file)
+                        )
+                        for position, maintainer in enumerate(maintainers)
+                    ),
+                )
+            conn.executescript(cls.INDEXES)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            conn.close()
+        tmp_path.replace(path)
+
+    def maintainers(self, package: str) -> list[str]:
+        """Get the maintainers of a package, in their original order."""
+        rows = self.conn.execute(
+            "SELECT maintainer FROM maintainers WHERE package = ? ORDER BY position",
+            (package,),
+        )
+        return [maintainer for maintainer, in rows]
+
+    def maintained(self, maintainers: Iterable[str]) -> Iterator[tuple[str, str]]:
+        """
+        Get the `(package, maintainer)` of the packages of `maintainers`, in the
+        order of the file.
+        """
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS wanted (name TEXT PRIMARY KEY)"
+            " WITHOUT ROWID"
+        )
+        with self.conn:
+            self.conn.execute("DELETE FROM wanted")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO wanted VALUES (?)",
+                ((maintainer,) for maintainer in maintainers),
+            )
+        yield from self.conn.execute(
+            """
+            SELECT package, maintainer FROM maintainers
+            JOIN wanted ON name = maintainer
+            ORDER BY package_position, position
+            """
+        )
+
+    def close(self) -> None:
+        self.conn.close()
 
 
 @click.command()
@@ -37,37 +298,107 @@ all_package_maintainers = response.json()["rpms"]
 @click.option(
     "--format",
     default="merged",
-    type=click.Choice(["merged", "json"]),
+    type=click.Choice(["merged", "json", "jsonl", "grouped"]),
     help="""\b
     The output format:
-     - merged: all maintainers combined
-     - json: JSON format same as the pagure_bz.json file
+     - merged: all maintainers (packages with --reverse) combined
+     - json: JSON format same as the pagure_bz.json file, or the packages of
+       each maintainer with --reverse
+     - jsonl: a JSON-lines record per package
+     - grouped: each maintainer followed by their packages
+    """,
+)
+@click.option(
+    "--reverse",
+    is_flag=True,
+    help="""
+    Read maintainers instead of packages and get the packages they maintain.
+    """,
+)
+@click.option(
+    "--url",
+    default=MAINTAINERS_URL,
+    help="""
+    URL of the `pagure_bz.json` file.
+    """,
+)
+@click.option(
+    "--cache-dir",
+    default=CACHE_DIR,
+    help="""
+    Directory where the downloaded maintainers data is cached.
+    """,
+    type=click.Path(file_okay=False, path_type=Path),
+)
+@click.option(
+    "--cache-ttl",
+    default=cache_ttl,
+    help="""
+    Number of seconds for which the cache is used without checking for
+    updates. Use 0 to always revalidate.
     """,
+    type=click.FloatRange(min=0),
 )
-def main(packages_file, format: str):
-    global packages, all_package_maintainers
-    if packages_file == "-":
-        if not sys.stdin.isatty():
-            packages = []
-            for pkg in sys.stdin:
-                packages.append(pkg.rstrip())
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="""
+    Only use the cached data.
+    """,
+)
+def main(
+    packages_file,
+    format: str,
+    reverse: bool,
+    url: str,
+    cache_dir: Path,
+    cache_ttl: float,
+    offline: bool,
+):
+    index = MaintainersIndex(
+        fetch_maintainers_index(
+            url,
+            cache_dir,
+            cache_ttl,
+            offline=offline,
+        )
+    )
+    # The packages or maintainers to look for, in their input order
+    wanted = dict.fromkeys(read_packages(packages_file, packages))
+    # Maintainer -> packages, only for the wanted packages or maintainers
+    maintainer_packages: dict[str, list[str]] = {}
+    pkg_maintainers: dict[str, list[str]] = {}
+    if reverse:
+        for pkg, maintainer in index.maintained(wanted):
+            maintainer_packages.setdefault(maintainer, []).append(pkg)
+            pkg_maintainers.setdefault(pkg, []).append(maintainer)
+        maintainer_packages = {
+            maintainer: maintainer_packages[maintainer]
+            for maintainer in wanted
+            if maintainer in maintainer_packages
+        }
     else:
-        with Path(packages_file).open("r") as f:
-            packages = f.read().rstrip().split("\n")
-
-    pkg_maintainers = {
-        key: val for key, val in all_package_maintainers.items() if key in packages
-    }
+        for pkg in wanted:
+            if maintainers := index.maintainers(pkg):
+                pkg_maintainers[pkg] = maintainers
+                for maintainer in maintainers:
+                    maintainer_packages.setdefault(maintainer, []).append(pkg)
+        maintainer_packages = dict(sorted(maintainer_packages.items()))
+    index.close()
 
+    out = RecordWriter(json_lines=format == "jsonl")
     match format:
+        case "jsonl":
+            for pkg, maintainers in pkg_maintainers.items():
+                out.emit(pkg, "maintainers", maintainers=maintainers)
         case "json":
-            click.echo(json.dumps(pkg_maintainers))
+            click.echo(json.dumps(maintainer_packages if reverse else pkg_maintainers))
         case "merged":
-            merged_maintainers = sorted(
-                set(x for maintainers in pkg_maintainers.values() for x in maintainers)
-            )
-            for maintainer in merged_maintainers:
-                click.echo(maintainer)
+            for item in sorted(pkg_maintainers if reverse else maintainer_packages):
+                click.echo(item)
+        case "grouped":
+            for maintainer, maintainer_pkgs in maintainer_packages.items():
+                click.echo(f"{maintainer}: {' '.join(sorted(maintainer_pkgs))}")
         case _:
             raise NotImplementedError
 
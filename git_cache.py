@@ -0,0 +1,118 @@
+"""
+Local git object cache for the dist-git clones shared by the scripts.
+
+Each package gets a bare mirror in the cache directory that is fetched at
+most once per run. New `fedpkg clone` then reference the mirror so that only
+the missing objects are downloaded. The objects are copied into the clones,
+so the mirrors can be pruned or removed at any time. If a mirror cannot be
+fetched, the package is cloned without it.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+DISTGIT_URL = "https://src.fedoraproject.org/rpms/{pkg}.git"
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "fedora-scripts"
+    / "git"
+)
+
+
+class GitObjectCache:
+    def __init__(self, cache_dir: Path = CACHE_DIR):
+        self.cache_dir = cache_dir
+        # Package -> mirror, None if it could not be fetched
+        self._mirrors: dict[str, Path | None] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, pkg: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(pkg, threading.Lock())
+
+    def mirror(self, pkg: str) -> Path | None:
+        """
+        Get the up-to-date bare mirror of a package, fetching it only once.
+
+        None is returned if the mirror could not be fetched.
+        """
+        mirror_dir = self.cache_dir / f"{pkg}.git"
+        with self._lock(pkg):
+            if pkg in self._mirrors:
+                return self._mirrors[pkg]
+            try:
+                if mirror_dir.exists():
+                    subprocess.run(
+                        ["git", "fetch", "--quiet", "--prune"],
+                        cwd=mirror_dir,
+                        check=True,
+                    )
+                else:
+                    self.cache_dir.mkdir(parents=True, exist_ok=True)
+                    subprocess.run(
+                        [
+                            "git",
+                            "clone",
+                            "--quiet",
+                            "--mirror",
+                            DISTGIT_URL.format(pkg=pkg),
+                            str(mirror_dir),
+                        ],
+                        check=True,
+                    )
+                self._mirrors[pkg] = mirror_dir
+            except subprocess.CalledProcessError as exc:
+                print(f"Not using the git cache for {pkg}: {exc}", file=sys.stderr)
+                if exc.cmd[1] == "clone":
+                    # Do not keep a partial mirror
+                    shutil.rmtree(mirror_dir, ignore_errors=True)
+                self._mirrors[pkg] = None
+        return self._mirrors[pkg]
+
+    def clone_args(
+        self,
+        pkg: str,
+        depth: int | None = None,
+        sparse: bool = False,
+    ) -> list[str]:
+        """
+        Get the `fedpkg clone` arguments to clone `pkg` using the cache.
+
+        With `sparse` the clone is not checked out, see `sparse_checkout`.
+        """
+        git_args = []
+        if mirror_dir := self.mirror(pkg):
+            # Copy the objects so that the clone survives the pruning of the mirror
+            git_args.extend(["--reference-if-able", str(mirror_dir), "--dissociate"])
+        if depth:
+            git_args.extend(["--depth", str(depth)])
+        if sparse:
+            git_args.append("--no-checkout")
+        args = ["fedpkg", "clone", pkg]
+        if git_args:
+            args.extend(["--", *git_args])
+        return args
+
+
+def sparse_checkout(repo_dir: Path, exclude: list[str]) -> None:
+    """Check out a `--no-checkout` clone without the `exclude` patterns."""
+    subprocess.run(
+        [
+            "git",
+            "sparse-checkout",
+            "set",
+            "--no-cone",
+            "/*",
+            *(f"!/{pattern}" for pattern in exclude),
+        ],
+        cwd=repo_dir,
+        check=True,
+    )
+    subprocess.run(["git", "checkout", "--quiet"], cwd=repo_dir, check=True)
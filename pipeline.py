@@ -0,0 +1,84 @@
+"""
+Streaming input and output of the scripts so that they can be chained.
+
+The packages are read lazily, one per line, so that a script can start
+working on the first packages while the previous one is still producing
+them. The lines can also be the JSON-lines records written by the scripts,
+in which case their `package` is used.
+
+This is not a standalone script, the scripts using it must depend on `click`.
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+import threading
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import click
+
+
+def parse_package(line: str) -> str | None:
+    """Get the package of a line of input, either a plain name or a record."""
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith("{"):
+        return json.loads(line).get("package")
+    return line
+
+
+def read_packages(
+    packages_file: str | Path | None,
+    default: Iterable[str] = (),
+) -> Iterator[str]:
+    """
+    Lazily read the packages from a file, or from STDIN if `packages_file` is
+    `-` and STDIN is not a terminal. Otherwise the `default` packages are
+    used. Each package is only given once.
+    """
+    seen = set()
+
+    def unique(packages: Iterable[str | None]) -> Iterator[str]:
+        for pkg in packages:
+            if pkg and pkg not in seen:
+                seen.add(pkg)
+                yield pkg
+
+    if packages_file == "-":
+        if sys.stdin.isatty():
+            yield from unique(default)
+        else:
+            yield from unique(map(parse_package, sys.stdin))
+    elif packages_file:
+        with Path(packages_file).open("r") as f:
+            yield from unique(map(parse_package, f))
+    else:
+        yield from unique(default)
+
+
+class RecordWriter:
+    """
+    Output of the scripts, either human readable or JSON-lines records.
+
+    In JSON-lines mode each record is written to STDOUT as soon as it is
+    emitted and the human readable messages go to STDERR instead.
+    """
+
+    def __init__(self, json_lines: bool = False):
+        self.json_lines = json_lines
+        self._lock = threading.Lock()
+
+    def echo(self, message: str, **styles) -> None:
+        with self._lock:
+            click.secho(message, err=self.json_lines, **styles)
+
+    def emit(self, package: str, action: str, **fields) -> None:
+        if not self.json_lines:
+            return
+        record = json.dumps({"package": package, "action": action, **fields})
+        with self._lock:
+            # click.echo flushes the record right away
+            click.echo(record)
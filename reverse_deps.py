@@ -0,0 +1,499 @@
+"""
+Reverse dependency helpers shared by the scripts.
+
+This is not a standalone script, the scripts using it must depend on `fedrq`.
+"""
+
+from __future__ import annotations
+
+import collections
+import hashlib
+import http.client
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import typing
+import urllib.request
+from collections.abc import Iterable
+from pathlib import Path
+
+from fedrq.config import get_config
+
+if typing.TYPE_CHECKING:
+    from fedrq.backends.base import PackageCompat, RepoqueryBase
+
+# Tokens of rich dependencies that are not package names
+RICH_DEP_KEYWORDS = {"and", "or", "if", "else", "with", "without", "unless"}
+RICH_DEP_OPERATORS = {"<", "<=", "=", ">=", ">"}
+MIRROR_URL = os.environ.get(
+    "FEDORA_MIRROR_URL", "https://dl.fedoraproject.org/pub/fedora/linux"
+)
+INDEX_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "fedora-scripts"
+    / "repodata"
+)
+
+
+def get_rq(branch: str) -> RepoqueryBase:
+    """Load the repodata of a branch once so that it can be queried in-process."""
+    return get_config().get_rq(branch)
+
+
+def source_name(package: PackageCompat) -> str:
+    """Equivalent of fedrq's `-F=source` formatter."""
+    if package.arch == "src":
+        return package.name
+    return package.source_name
+
+
+def resolve_reverse_deps(
+    packages: Iterable[str],
+    branch: str,
+    rq: RepoqueryBase | RepodataIndex | None = None,
+) -> dict[str, list[str]]:
+    """
+    Get the source packages requiring any of the subpackages of each package.
+
+    This is equivalent to `fedrq wrsrc {pkg} -F=source -b={branch}` for all the
+    packages, but the repodata is loaded once and the reverse dependencies are
+    queried together. The package itself is not included in its own reverse
+    dependencies.
+    """
+    if rq is None:
+        rq = get_rq(branch)
+    if isinstance(rq, RepodataIndex):
+        return rq.reverse_deps(packages)
+    packages = list(dict.fromkeys(packages))
+    srpms = rq.query(name=packages, arch="src", latest=1)
+    subpackages = rq.get_subpackages(srpms)
+    # All the reverse dependencies in one go, each package then only needs to
+    # filter this (much smaller) set.
+    all_rdeps = rq.query(requires=subpackages)
+    rev_deps = {}
+    for pkg in packages:
+        pkg_subpackages = rq.get_subpackages(srpms.filter(name=pkg))
+        pkg_rdeps = all_rdeps.filter(requires=pkg_subpackages)
+        rev_deps[pkg] = sorted({source_name(dep) for dep in pkg_rdeps} - {pkg})
+    return rev_deps
+
+
+def dependency_names(requirement: str) -> list[str]:
+    """
+    Get the names of the capabilities of a requirement, ignoring the version
+    constraints. Rich dependencies give all the capabilities they reference.
+    """
+    if not requirement.startswith("("):
+        return [requirement.split(" ", 1)[0]]
+    names = []
+    tokens = [token for token in re.split(r"[\s()]+", requirement) if token]
+    skip_next = False
+    for token in tokens:
+        if skip_next:
+            skip_next = False
+        elif token in RICH_DEP_OPERATORS:
+            # The next token is the version
+            skip_next = True
+        elif token not in RICH_DEP_KEYWORDS:
+            names.append(token)
+    return names
+
+
+class ReverseDepGraph:
+    """
+    Reverse dependency graph of the source packages of a branch.
+
+    The index from each source package to the source packages requiring (or
+    build-requiring) any of its subpackages is built once from the repodata,
+    or queried as needed from a `RepodataIndex`. Requirements are matched to
+    the provides and required files by name only.
+    """
+
+    def __init__(self, rq: RepoqueryBase | RepodataIndex):
+        if isinstance(rq, RepodataIndex):
+            # Only the packages that are reached are queried from the index
+            self.requirers_of = rq.requirers
+            return
+        packages = list(rq.query(latest=1))
+        requires = {
+            pkg: [name for req in pkg.requires for name in dependency_names(str(req))]
+            for pkg in packages
+        }
+        required_files = {
+            name
+            for pkg_requires in requires.values()
+            for name in pkg_requires
+            if name.startswith("/")
+        }
+        # Capability -> source packages providing it
+        providers: dict[str, set[str]] = collections.defaultdict(set)
+        for pkg in packages:
+            if pkg.arch == "src":
+                continue
+            src = source_name(pkg)
+            for prov in pkg.provides:
+                providers[str(prov).split(" ", 1)[0]].add(src)
+            for file in pkg.files:
+                if file in required_files:
+                    providers[file].add(src)
+        self.requirers: dict[str, set[str]] = collections.defaultdict(set)
+        for pkg, pkg_requires in requires.items():
+            src = source_name(pkg)
+            for name in pkg_requires:
+                for provider in providers.get(name, ()):
+                    if provider != src:
+                        self.requirers[provider].add(src)
+        self.requirers_of = lambda pkg: self.requirers.get(pkg, ())
+
+    def closure(
+        self,
+        packages: Iterable[str],
+        max_depth: int | None = None,
+        skip: Iterable[str] = (),
+    ) -> dict[str, int]:
+        """
+        Get the transitive reverse dependencies of the packages up to `max_depth`
+        levels, mapped to their depth. The packages themselves have depth 0.
+
+        The `skip` packages are neither included nor expanded. Each package is
+        visited once, at its lowest depth, so cycles are not an issue.
+        """
+        skip = set(skip)
+        depths = {pkg: 0 for pkg in packages if pkg not in skip}
+        queue = collections.deque(depths)
+        while queue:
+            pkg = queue.popleft()
+            depth = depths[pkg] + 1
+            if max_depth is not None and depth > max_depth:
+                continue
+            for dep in sorted(self.requirers_of(pkg)):
+                if dep in depths or dep in skip:
+                    continue
+                depths[dep] = depth
+                queue.append(dep)
+        return depths
+
+
+def build_requires_graph(
+    packages: Iterable[str],
+    rq: RepoqueryBase | RepodataIndex,
+) -> dict[str, set[str]]:
+    """
+    Get the packages among `packages` that each of them build-requires.
+
+    Only the subpackages of `packages` are considered as providers, and the
+    requirements are matched to them by name only.
+    """
+    if isinstance(rq, RepodataIndex):
+        return rq.build_requires_graph(packages)
+    packages = list(dict.fromkeys(packages))
+    srpms = rq.query(name=packages, arch="src", latest=1)
+    build_requires = {
+        srpm.name: [
+            name for req in srpm.requires for name in dependency_names(str(req))
+        ]
+        for srpm in srpms
+    }
+    required_files = {
+        name
+        for srpm_requires in build_requires.values()
+        for name in srpm_requires
+        if name.startswith("/")
+    }
+    # Capability -> packages providing it
+    providers: dict[str, set[str]] = collections.defaultdict(set)
+    for pkg in rq.get_subpackages(srpms):
+        src = source_name(pkg)
+        for prov in pkg.provides:
+            providers[str(prov).split(" ", 1)[0]].add(src)
+        for file in pkg.files:
+            if file in required_files:
+                providers[file].add(src)
+    graph = {pkg: set() for pkg in packages}
+    for pkg, srpm_requires in build_requires.items():
+        for name in srpm_requires:
+            graph[pkg].update(providers.get(name, set()) - {pkg})
+    return graph
+
+
+def topological_layers(graph: dict[str, set[str]]) -> list[list[str]]:
+    """
+    Split the packages of a dependency graph into layers, each package only
+    depending on the packages of the previous layers.
+
+    The packages of a dependency cycle, and the ones depending on them, end up
+    together in the last layer.
+    """
+    remaining = {pkg: set(deps) & graph.keys() for pkg, deps in graph.items()}
+    layers = []
+    while remaining:
+        layer = sorted(pkg for pkg, deps in remaining.items() if not deps)
+        if not layer:
+            layers.append(sorted(remaining))
+            break
+        layers.append(layer)
+        for pkg in layer:
+            del remaining[pkg]
+        for deps in remaining.values():
+            deps.difference_update(layer)
+    return layers
+
+
+def repomd_urls(
+    branch: str, arch: str = "x86_64", mirror_url: str | None = None
+) -> list[str]:
+    """Get the `repomd.xml` URLs of the default repositories of a branch."""
+    mirror_url = mirror_url or MIRROR_URL
+    if branch == "rawhide":
+        base = f"{mirror_url}/development/rawhide/Everything"
+        return [
+            f"{base}/{arch}/os/repodata/repomd.xml",
+            f"{base}/source/tree/repodata/repomd.xml",
+        ]
+    if not re.fullmatch(r"f\d+", branch):
+        return []
+    release = branch[1:]
+    return [
+        f"{mirror_url}/releases/{release}/Everything/{arch}/os/repodata/repomd.xml",
+        f"{mirror_url}/releases/{release}/Everything/source/tree/repodata/repomd.xml",
+        f"{mirror_url}/updates/{release}/Everything/{arch}/repodata/repomd.xml",
+        f"{mirror_url}/updates/{release}/Everything/source/tree/repodata/repomd.xml",
+    ]
+
+
+def repomd_checksum(
+    branch: str, timeout: float = 10, mirror_url: str | None = None
+) -> str | None:
+    """Checksum of the `repomd.xml` of a branch, if they can be fetched."""
+    urls = repomd_urls(branch, mirror_url=mirror_url)
+    if not urls:
+        return None
+    digest = hashlib.sha256()
+    try:
+        for url in urls:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                digest.update(response.read())
+    except (OSError, http.client.HTTPException):
+        return None
+    return digest.hexdigest()
+
+
+class RepodataIndex:
+    """
+    Persistent index of the repodata of a branch, in an SQLite database that is
+    memory-mapped when it is queried.
+
+    It maps the source packages to their binary packages, and the capabilities
+    (provides and required files) to the source packages providing and
+    requiring them, matched by name only like `ReverseDepGraph`. Building it
+    needs the repodata loaded by fedrq, querying it does not.
+    """
+
+    SCHEMA = """
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+        CREATE TABLE srpms (name TEXT PRIMARY KEY, evr TEXT) WITHOUT ROWID;
+        CREATE TABLE binaries (
+            source TEXT NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (source, name)
+        ) WITHOUT ROWID;
+        CREATE TABLE provides (
+            capability TEXT NOT NULL,
+            source TEXT NOT NULL,
+            PRIMARY KEY (capability, source)
+        ) WITHOUT ROWID;
+        CREATE TABLE requires (
+            capability TEXT NOT NULL,
+            source TEXT NOT NULL,
+            -- Whether it is a BuildRequires of the source package
+            build INTEGER NOT NULL,
+            PRIMARY KEY (capability, source, build)
+        ) WITHOUT ROWID;
+        """
+    # Created once the tables are filled
+    INDEXES = """
+        CREATE INDEX binaries_name ON binaries (name);
+        CREATE INDEX provides_source ON provides (source, capability);
+        CREATE INDEX requires_source ON requires (source, build, capability);
+        """
+
+    def __init__(self, path: Path, mmap_size: int = 2**30):
+        self.path = path
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        self.conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+
+    @classmethod
+    def build(cls, path: Path, rq: RepoqueryBase, **meta: str) -> RepodataIndex:
+        """Build the index of the repodata of `rq` at `path`, replacing it."""
+        packages = list(rq.query(latest=1))
+        requires = {
+            pkg: {name for req in pkg.requires for name in dependency_names(str(req))}
+            for pkg in packages
+        }
+        required_files = {
+            name
+            for pkg_requires in requires.values()
+            for name in pkg_requires
+            if name.startswith("/")
+        }
+        # Concurrent runs may build the same index, each in its own file
+        fd, tmp_name = tempfile.mkstemp(
+            prefix=f".{path.name}.", suffix=".tmp", dir=path.parent
+        )
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # The file is only used once it is complete
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.executescript(cls.SCHEMA)
+            with conn:
+                conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+                conn.executemany(
+                    "INSERT OR REPLACE INTO srpms VALUES (?, ?)",
+                    (
+                        (pkg.name, f"{pkg.version}-{pkg.release}")
+                        for pkg in packages
+                        if pkg.arch == "src"
+                    ),
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO binaries VALUES (?, ?)",
+                    (
+                        (source_name(pkg), pkg.name)
+                        for pkg in packages
+                        if pkg.arch != "src"
+                    ),
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO provides VALUES (?, ?)",
+                    (
+                        (capability, source_name(pkg))
+                        for pkg in packages
+                        if pkg.arch != "src"
+                        for capability in (
+                            *(str(prov).split(" ", 1)[0] for prov in pkg.provides),
+                            *(file for file in pkg.files if file in required_files),
+                        )
+                    ),
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO requires VALUES (?, ?, ?)",
+                    (
+                        (name, source_name(pkg), pkg.arch == "src")
+                        for pkg, pkg_requires in requires.items()
+                        for name in pkg_requires
+                    ),
+                )
+            conn.executescript(cls.INDEXES)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            conn.close()
+        tmp_path.replace(path)
+        return cls(path)
+
+    def meta(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return next((value for value, in row), None)
+
+    def __contains__(self, name: str) -> bool:
+        row = self.conn.execute("SELECT 1 FROM srpms WHERE name = ?", (name,))
+        return row.fetchone() is not None
+
+    def subpackages(self, source: str) -> list[str]:
+        """Get the binary packages of a source package."""
+        rows = self.conn.execute(
+            "SELECT name FROM binaries WHERE source = ? ORDER BY name", (source,)
+        )
+        return [name for name, in rows]
+
+    def source(self, binary: str) -> str | None:
+        """Get the source package of a binary package."""
+        row = self.conn.execute("SELECT source FROM binaries WHERE name = ?", (binary,))
+        return next((source for source, in row), None)
+
+    def requirers(self, source: str) -> set[str]:
+        """Get the source packages requiring any of the subpackages of `source`."""
+        rows = self.conn.execute(
+            """
+            SELECT DISTINCT r.source FROM provides p
+            JOIN requires r ON r.capability = p.capability
+            WHERE p.source = ? AND r.source != p.source
+            """,
+            (source,),
+        )
+        return {name for name, in rows}
+
+    def build_requires(self, source: str) -> set[str]:
+        """Get the source packages providing the BuildRequires of `source`."""
+        rows = self.conn.execute(
+            """
+            SELECT DISTINCT p.source FROM requires r
+            JOIN provides p ON p.capability = r.capability
+            WHERE r.source = ? AND r.build AND p.source != r.source
+            """,
+            (source,),
+        )
+        return {name for name, in rows}
+
+    def reverse_deps(self, packages: Iterable[str]) -> dict[str, list[str]]:
+        """Same as `resolve_reverse_deps`, from the index."""
+        return {pkg: sorted(self.requirers(pkg)) for pkg in dict.fromkeys(packages)}
+
+    def build_requires_graph(self, packages: Iterable[str]) -> dict[str, set[str]]:
+        """Same as `build_requires_graph`, from the index."""
+        packages = list(dict.fromkeys(packages))
+        selected = set(packages)
+        return {pkg: self.build_requires(pkg) & selected for pkg in packages}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def get_index(
+    branch: str,
+    index_dir: Path | None = None,
+    ttl: float = 24 * 3600,
+    check_interval: float = 3600,
+    mirror_url: str | None = None,
+) -> RepodataIndex:
+    """
+    Get the repodata index of a branch, only building it when the repodata
+    changed.
+
+    The index is keyed by the checksum of the `repomd.xml` of the branch,
+    fetched from `mirror_url` (by default `MIRROR_URL`) at most once every
+    `check_interval` seconds. If they cannot be fetched, the last index of the
+    branch is used as long as it is younger than `ttl` seconds.
+    """
+    index_dir = index_dir or INDEX_DIR
+    existing = sorted(
+        index_dir.glob(f"{branch}-*.sqlite"), key=lambda path: path.stat().st_mtime
+    )
+    if existing and time.time() - existing[-1].stat().st_mtime < check_interval:
+        return RepodataIndex(existing[-1])
+    checksum = repomd_checksum(branch, mirror_url=mirror_url)
+    if checksum:
+        path = index_dir / f"{branch}-{checksum[:16]}.sqlite"
+        if path.exists():
+            # Only check the repodata again after another interval
+            os.utime(path)
+            return RepodataIndex(path)
+    elif existing and time.time() - existing[-1].stat().st_mtime < ttl:
+        return RepodataIndex(existing[-1])
+    else:
+        path = index_dir / f"{branch}-{int(time.time())}.sqlite"
+    index_dir.mkdir(parents=True, exist_ok=True)
+    index = RepodataIndex.build(
+        path, get_rq(branch), branch=branch, checksum=checksum or ""
+    )
+    # The runs still using an older index keep it open
+    for old_path in existing:
+        if old_path != path:
+            old_path.unlink(missing_ok=True)
+    return index
@@ -1,18 +1,52 @@
 # /// script
 # dependencies = [
 #   "click",
+#   "specfile",
 # ]
 # ///
 from __future__ import annotations
 
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import os
 import re
+import shutil
+import statistics
 import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections.abc import Iterator
 from pathlib import Path
 import sys
 
 import click
+from specfile import Specfile
+from specfile.exceptions import SpecfileException
 
-SOURCE_RE = re.compile(r"Source\d+: (.*#/)?(?P<file>.+)")
+from git_cache import GitObjectCache
+from pipeline import RecordWriter, read_packages
+
+MANIFEST_FILE = ".update_downstream_manifest.json"
+JOURNAL_FILE = ".update_downstream_journal.jsonl"
+# Stages that talk to the dist-git/lookaside servers. Everything else is
+# considered local work and is limited separately.
+NETWORK_STAGES = {"clone", "fork", "pull", "new-sources", "push"}
+# Line of the dist-git `sources` file
+SOURCES_LINE_RE = re.compile(r"(?P<algo>\w+) \((?P<file>.+)\) = (?P<hash>[0-9a-f]+)")
+# Stages with their own limits
+UNLIMITED_STAGES = {"download"}
+# Seconds after which a stalled source download fails
+DOWNLOAD_TIMEOUT = 60
+SOURCE_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "fedora-scripts"
+    / "sources"
+)
 
 # Variables for the lazy
 # You can add them manually here instead of passing via CLI
@@ -25,6 +59,489 @@ branch = "update-{pkg}-{version}"
 commit_msg = "Update to version {version}{rhbz_msg}"
 rhbz_msg = "; Fixes RHBZ#{bug}"
 fas_id = None
+jobs = 1
+network_jobs = 4
+local_jobs = None
+incremental = False
+git_cache_dir = None
+trace_file = None
+source_cache_dir = SOURCE_CACHE_DIR
+download_jobs = 8
+json_lines = False
+resume = False
+
+# Serializes the output of the packages and the interactive prompts
+_output_lock = threading.Lock()
+
+
+class PkgLog:
+    """
+    Output of a single package.
+
+    When running in parallel the output is buffered and printed as one block
+    once the package is done so that the logs of different packages are not
+    interleaved.
+    """
+
+    def __init__(self, pkg: str, buffered: bool = False, err: bool = False):
+        self.pkg = pkg
+        self.buffered = buffered
+        self.err = err
+        self._lines: list[tuple[str, dict]] = []
+
+    def secho(self, message: str, **styles) -> None:
+        if self.buffered:
+            self._lines.append((message, styles))
+        else:
+            click.secho(message, err=self.err, **styles)
+
+    def echo(self, message: str) -> None:
+        self.secho(message)
+
+    def confirm(self, text: str) -> bool:
+        # Flush what we have so far so that the prompt has its context
+        with _output_lock:
+            self._flush()
+            return click.confirm(text, err=self.err)
+
+    def flush(self) -> None:
+        with _output_lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._lines:
+            return
+        click.secho(f"==> {self.pkg}", bold=True, err=self.err)
+        for message, styles in self._lines:
+            click.secho(message, err=self.err, **styles)
+        self._lines = []
+
+
+class PushManifest:
+    """
+    Content hashes of the package directories that were last pushed.
+
+    The manifest is stored in the downstream directory and is used to skip the
+    packages whose content did not change since their last successful push.
+    """
+
+    def __init__(self, path: Path, salt: str = ""):
+        self.path = path
+        # Anything else that affects the result, e.g. the rsync filters
+        self.salt = salt
+        self.data: dict[str, str] = {}
+        if path.exists():
+            with path.open("r") as f:
+                self.data = json.load(f)
+        self._lock = threading.Lock()
+
+    def hash_dir(self, pkg_dir: Path) -> str:
+        digest = hashlib.sha256(self.salt.encode())
+        for file in sorted(pkg_dir.rglob("*")):
+            if not file.is_file():
+                continue
+            digest.update(str(file.relative_to(pkg_dir)).encode() + b"\0")
+            with file.open("rb") as f:
+                digest.update(hashlib.file_digest(f, "sha256").digest())
+        return digest.hexdigest()
+
+    def is_unchanged(self, pkg: str, content_hash: str) -> bool:
+        return self.data.get(pkg) == content_hash
+
+    def record(self, pkg: str, content_hash: str) -> None:
+        with self._lock:
+            self.data[pkg] = content_hash
+            tmp_path = self.path.with_suffix(".tmp")
+            with tmp_path.open("w") as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
+            tmp_path.replace(self.path)
+
+
+class RunJournal:
+    """
+    Stages completed by each package during a run.
+
+    Each completed stage is appended as a JSON line as soon as it is done, so
+    that an interrupted run can be resumed without repeating them. A new run
+    starts a new journal unless it is resumed.
+    """
+
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = path
+        # Package -> stage -> data of the stage
+        self.stages: dict[str, dict[str, dict]] = {}
+        if resume and path.exists():
+            with path.open("r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Partially written when the run was interrupted
+                        continue
+                    pkg_stages = self.stages.setdefault(entry.pop("pkg"), {})
+                    pkg_stages[entry.pop("stage")] = entry
+        self._file = path.open("a" if resume else "w")
+        self._lock = threading.Lock()
+
+    def done(self, pkg: str) -> dict[str, dict]:
+        """Get the stages that the package already completed, with their data."""
+        return self.stages.get(pkg, {})
+
+    def record(self, pkg: str, stage: str, **data) -> None:
+        with self._lock:
+            self.stages.setdefault(pkg, {})[stage] = data
+            self._file.write(json.dumps({"pkg": pkg, "stage": stage, **data}) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class SpecModel:
+    """
+    The package's spec file, parsed and macro-expanded once.
+
+    This replaces the separate `rpmspec`, `rpmdev-bumpspec` and `spectool`
+    calls which each had to parse the spec file again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.spec = Specfile(path, sourcedir=path.parent, autosave=False)
+
+    @property
+    def version(self) -> str:
+        return self.spec.expanded_version
+
+    @property
+    def evr(self) -> str:
+        """The version-release, the bump does not change the epoch."""
+        return f"{self.spec.expanded_version}-{self.spec.expanded_release}"
+
+    def sources(self) -> list[tuple[str, str]]:
+        """Get the `(location, file name)` of the `Source` entries."""
+        with self.spec.sources() as sources:
+            return [
+                (source.expanded_location, source.expanded_filename)
+                for source in sources
+            ]
+
+    def bump(self, changelog: str) -> None:
+        """Same as `rpmdev-bumpspec -c {changelog}`."""
+        self.spec.bump_release()
+        self.spec.add_changelog_entry(f"- {changelog}")
+
+    def save(self) -> None:
+        self.spec.save()
+
+
+class SourceFetcher:
+    """
+    Download the package sources concurrently through a content-addressed cache.
+
+    The downloaded files are stored by their SHA-512 checksum and the URLs
+    are indexed to the checksum of their content along with its validators
+    (`ETag`/`Last-Modified`). The files are then hard-linked into the package
+    directories. A source that was already downloaded, by any package in any
+    run, is only revalidated with a conditional request, or downloaded again
+    without validators. Its cached file is checked against its checksum before
+    it is used.
+    """
+
+    def __init__(self, cache_dir: Path | None, max_connections: int):
+        self.cache_dir = cache_dir
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_connections
+        )
+        self._url_locks: dict[str, threading.Lock] = {}
+        self._url_locks_lock = threading.Lock()
+        # Checksums of the objects already verified during this run
+        self._verified: set[str] = set()
+        if cache_dir:
+            (cache_dir / "objects").mkdir(parents=True, exist_ok=True)
+            (cache_dir / "urls").mkdir(parents=True, exist_ok=True)
+
+    def _url_lock(self, url: str) -> threading.Lock:
+        with self._url_locks_lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def _url_index(self, url: str) -> Path:
+        return self.cache_dir / "urls" / hashlib.sha256(url.encode()).hexdigest()
+
+    @contextlib.contextmanager
+    def _part_file(self, name: str) -> Iterator[Path]:
+        """Temporary download file, removed unless it was moved."""
+        fd, tmp_name = tempfile.mkstemp(
+            prefix=f".{name}.",
+            suffix=".part",
+            dir=self.cache_dir / "objects" if self.cache_dir else None,
+        )
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        try:
+            yield tmp_path
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _download(
+        self, url: str, dest: Path, headers: dict[str, str] | None = None
+    ) -> tuple[str | None, dict[str, str | None]]:
+        """
+        Download `url` to `dest`, returning the SHA-512 of the content and its
+        validators. The checksum is None if the content was not modified.
+        """
+        digest = hashlib.sha512()
+        try:
+            request = urllib.request.Request(url, headers=headers or {})
+            response = urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+        except urllib.error.HTTPError as exc:
+            if exc.code == 304:
+                return None, {}
+            raise
+        except ValueError as exc:
+            # Only fail the package of a malformed Source URL
+            raise urllib.error.URLError(f"{url}: {exc}") from exc
+        with response, dest.open("wb") as f:
+            while chunk := response.read(1 << 20):
+                digest.update(chunk)
+                f.write(chunk)
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        return digest.hexdigest(), validators
+
+    def _verify(self, obj: Path) -> bool:
+        """Check that a cached object matches its checksum, removing it if not."""
+        if obj.name in self._verified:
+            return True
+        with obj.open("rb") as f:
+            if hashlib.file_digest(f, "sha512").hexdigest() != obj.name:
+                obj.unlink(missing_ok=True)
+                return False
+        self._verified.add(obj.name)
+        return True
+
+    def _fetch(self, url: str, dest: Path) -> int:
+        if dest.exists():
+            return 0
+        if not self.cache_dir:
+            with self._part_file(dest.name) as tmp_dest:
+                self._download(url, tmp_dest)
+                tmp_dest.chmod(0o644)
+                shutil.move(tmp_dest, dest)
+            return dest.stat().st_size
+        downloaded = 0
+        url_index = self._url_index(url)
+        with self._url_lock(url):
+            entry = json.loads(url_index.read_text()) if url_index.exists() else {}
+            obj = None
+            headers = {}
+            if entry:
+                cached = self.cache_dir / "objects" / entry["checksum"]
+                if cached.exists() and self._verify(cached):
+                    obj = cached
+                    # The content behind the URL may have changed
+                    if entry.get("etag"):
+                        headers["If-None-Match"] = entry["etag"]
+                    if entry.get("last_modified"):
+                        headers["If-Modified-Since"] = entry["last_modified"]
+            with self._part_file(url_index.name) as tmp_obj:
+                checksum, validators = self._download(url, tmp_obj, headers)
+                if checksum is not None:
+                    obj = self.cache_dir / "objects" / checksum
+                    # Protect the object from modifications through the hard-links
+                    tmp_obj.chmod(0o444)
+                    tmp_obj.replace(obj)
+                    self._verified.add(checksum)
+                    url_index.write_text(
+                        json.dumps({"checksum": checksum, **validators})
+                    )
+                    downloaded = obj.stat().st_size
+        try:
+            os.link(obj, dest)
+        except OSError:
+            # E.g. the cache is on a different filesystem
+            shutil.copyfile(obj, dest)
+        return downloaded
+
+    def fetch_all(self, sources: list[tuple[str, Path]]) -> int:
+        """Fetch all the `(url, dest)` concurrently, returning the bytes downloaded."""
+        futures = [
+            self.executor.submit(self._fetch, url, dest) for url, dest in sources
+        ]
+        return sum(future.result() for future in futures)
+
+
+def parse_sources_line(line: str) -> tuple[str, str, str] | None:
+    """Parse the `(file, algorithm, hash)` of a dist-git `sources` file line."""
+    if match := SOURCES_LINE_RE.fullmatch(line.strip()):
+        return (
+            match.group("file"),
+            match.group("algo").lower(),
+            match.group("hash"),
+        )
+    if len(parts := line.split()) == 2:
+        # Old format: `{md5}  {file}`
+        return parts[1], "md5", parts[0]
+    return None
+
+
+def read_sources_file(path: Path) -> dict[str, tuple[str, str]]:
+    """Read the `{file: (algorithm, hash)}` of a dist-git `sources` file."""
+    if not path.exists():
+        return {}
+    entries = {}
+    for line in path.read_text().splitlines():
+        if entry := parse_sources_line(line):
+            file_name, algo, file_hash = entry
+            entries[file_name] = (algo, file_hash)
+    return entries
+
+
+def sha512_files(files: list[Path], max_workers: int = 4) -> dict[Path, str]:
+    """Hash the files in parallel, streaming their content."""
+
+    def sha512(file: Path) -> str:
+        with file.open("rb") as f:
+            # file_digest reads in chunks and releases the GIL while hashing
+            return hashlib.file_digest(f, "sha512").hexdigest()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(files, executor.map(sha512, files)))
+
+
+class StageTracer:
+    """
+    Record timing spans of the stages as JSON-lines in a trace file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.spans: list[dict] = []
+        self._file = path.open("w")
+        self._lock = threading.Lock()
+
+    def record(self, span: dict) -> None:
+        with self._lock:
+            self.spans.append(span)
+            self._file.write(json.dumps(span) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def summary(self, err: bool = False) -> None:
+        durations: dict[str, list[float]] = {}
+        for span in self.spans:
+            durations.setdefault(span["stage"], []).append(span["duration"])
+        click.echo(
+            f"{'stage':<16}{'count':>7}{'p50 [s]':>10}{'p95 [s]':>10}{'total [s]':>11}",
+            err=err,
+        )
+        for stage, stage_durations in sorted(
+            durations.items(), key=lambda item: -sum(item[1])
+        ):
+            stage_durations.sort()
+            p95_index = max(0, int(len(stage_durations) * 0.95 + 0.5) - 1)
+            click.echo(
+                f"{stage:<16}{len(stage_durations):>7}"
+                f"{statistics.median(stage_durations):>10.2f}"
+                f"{stage_durations[p95_index]:>10.2f}"
+                f"{sum(stage_durations):>11.2f}",
+                err=err,
+            )
+
+
+class StageRunner:
+    """
+    Run the subprocesses of each stage, limiting how many network and local
+    stages are running at the same time.
+    """
+
+    def __init__(
+        self,
+        network_jobs: int,
+        local_jobs: int,
+        tracer: StageTracer | None = None,
+    ):
+        self.network_limit = threading.BoundedSemaphore(network_jobs)
+        self.local_limit = threading.BoundedSemaphore(local_jobs)
+        self.tracer = tracer
+
+    @contextlib.contextmanager
+    def span(
+        self,
+        log: PkgLog,
+        stage: str,
+        bytes_transferred: int | None = None,
+    ):
+        """
+        Limit and time a stage. In-process stages use it directly, with a
+        `returncode` of 1 if they raised.
+        """
+        if stage in UNLIMITED_STAGES:
+            limit = contextlib.nullcontext()
+        elif stage in NETWORK_STAGES:
+            limit = self.network_limit
+        else:
+            limit = self.local_limit
+        span = {
+            "package": log.pkg,
+            "stage": stage,
+            "returncode": 0,
+            "bytes": bytes_transferred,
+        }
+        queued = time.perf_counter()
+        with limit:
+            start = time.perf_counter()
+            try:
+                yield span
+            except BaseException:
+                span["returncode"] = 1
+                raise
+            finally:
+                end = time.perf_counter()
+                if self.tracer:
+                    self.tracer.record(
+                        {
+                            **span,
+                            "start": time.time() - (end - start),
+                            "wait": start - queued,
+                            "duration": end - start,
+                        }
+                    )
+
+    def run(
+        self,
+        log: PkgLog,
+        stage: str,
+        args: list[str],
+        cwd: Path | None = None,
+        check: bool = True,
+        capture_output: bool = False,
+        bytes_transferred: int | None = None,
+    ) -> subprocess.CompletedProcess:
+        kwargs = {}
+        if capture_output:
+            kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        elif log.buffered:
+            kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        with self.span(log, stage, bytes_transferred) as span:
+            res = subprocess.run(args, cwd=cwd, text=True, **kwargs)
+            span["returncode"] = res.returncode
+        if log.buffered:
+            # Keep the output of the stage in the package log
+            if not capture_output and res.stdout:
+                log.echo(res.stdout.rstrip())
+            if capture_output and res.stderr:
+                log.echo(res.stderr.rstrip())
+        elif capture_output and res.stderr:
+            click.echo(res.stderr, nl=False, err=True)
+        if check:
+            res.check_returncode()
+        return res
 
 
 @click.command()
@@ -91,6 +608,103 @@ fas_id = None
     FAS_ID, using `whoami` if not defined
     """,
 )
+@click.option(
+    "--jobs",
+    "-j",
+    default=jobs,
+    help="""
+    Number of packages to process in parallel.
+    """,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--network-jobs",
+    default=network_jobs,
+    help="""
+    Maximum number of network-bound stages (clone, fork, pull, new-sources,
+    push) running at the same time. The source downloads are limited by
+    --download-jobs instead.
+    """,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--local-jobs",
+    default=local_jobs,
+    help="""
+    Maximum number of local stages (rsync, spec update, git) running at
+    the same time. Defaults to the value of `--jobs`.
+    """,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--incremental/--no-incremental",
+    default=incremental,
+    help="""
+    Skip the packages whose content did not change since their last
+    successful push. Only the pushes of the incremental runs are recorded.
+    """,
+)
+@click.option(
+    "--git-cache",
+    "git_cache_dir",
+    default=git_cache_dir,
+    help="""
+    Directory of a local git object cache used by the new clones.
+    """,
+    type=click.Path(file_okay=False, path_type=Path),
+)
+@click.option(
+    "--trace",
+    "trace_file",
+    default=trace_file,
+    help="""
+    File where the timing of each stage is written as JSON-lines. A summary
+    per stage is printed at the end.
+    """,
+    type=click.Path(dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--source-cache",
+    "source_cache_dir",
+    default=source_cache_dir,
+    help="""
+    Directory of the content-addressed cache of the downloaded sources.
+    """,
+    type=click.Path(file_okay=False, path_type=Path),
+)
+@click.option(
+    "--no-source-cache",
+    is_flag=True,
+    help="""
+    Download the sources without going through the cache.
+    """,
+)
+@click.option(
+    "--download-jobs",
+    default=download_jobs,
+    help="""
+    Maximum number of source downloads running at the same time, across all
+    packages.
+    """,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--json-lines/--no-json-lines",
+    help="""
+    Write the result of each package as a JSON-lines record, as soon as it is
+    done. The other output goes to STDERR.
+    """,
+    default=json_lines,
+)
+@click.option(
+    "--resume/--no-resume",
+    help="""
+    Resume the previous run, skipping the stages that each package already
+    completed in it (clone, sync, bump, upload, commit, push). Changes made to
+    the working directory since then are not synced again.
+    """,
+    default=resume,
+)
 def main(
     packages_file,
     workdir: Path,
@@ -100,20 +714,25 @@ def main(
     branch: str,
     commit_msg: str,
     fas_id: str | None,
+    jobs: int,
+    network_jobs: int,
+    local_jobs: int | None,
+    incremental: bool,
+    git_cache_dir: Path | None,
+    trace_file: Path | None,
+    source_cache_dir: Path,
+    no_source_cache: bool,
+    download_jobs: int,
+    json_lines: bool,
+    resume: bool,
 ):
     global packages
 
-    pacakges_from_stdin = False
-    if packages_file == "-":
-        if not sys.stdin.isatty():
-            click.secho("BEWARE: All new sources are uploaded.", fg="red")
-            pacakges_from_stdin = True
-            packages = []
-            for pkg in sys.stdin:
-                packages.append(pkg.rstrip())
-    else:
-        with Path(packages_file).open("r") as f:
-            packages = f.read().rstrip().split("\n")
+    out = RecordWriter(json_lines)
+    pacakges_from_stdin = packages_file == "-" and not sys.stdin.isatty()
+    if pacakges_from_stdin:
+        out.echo("BEWARE: All new sources are uploaded.", fg="red")
+    packages = read_packages(packages_file, packages)
 
     if not downstream_dir:
         click.secho("Please specify the downstream-dir", err=True, fg="red")
@@ -136,47 +755,154 @@ def main(
         )
         fas_id = res.stdout.rstrip()
 
-    def process_pkg(pkg: str):
+    tracer = StageTracer(trace_file) if trace_file else None
+    runner = StageRunner(
+        network_jobs=network_jobs,
+        local_jobs=local_jobs or jobs,
+        tracer=tracer,
+    )
+
+    manifest = PushManifest(
+        downstream_dir / MANIFEST_FILE,
+        salt="\0".join(filter_args),
+    )
+
+    journal = RunJournal(downstream_dir / JOURNAL_FILE, resume=resume)
+    git_cache = GitObjectCache(git_cache_dir) if git_cache_dir else None
+    fetcher = SourceFetcher(
+        None if no_source_cache else source_cache_dir,
+        max_connections=download_jobs,
+    )
+
+    def upload_sources(
+        pkg: str,
+        log: PkgLog,
+        downstream_pkg_dir: Path,
+        sources: list[tuple[str, str]],
+    ) -> bool:
+        """Download and upload the new sources, returning whether to continue."""
+        with runner.span(log, "download") as span:
+            span["bytes"] = fetcher.fetch_all(
+                [
+                    (location, downstream_pkg_dir / file_name)
+                    for location, file_name in sources
+                    if "://" in location
+                ]
+            )
+        new_sources = []
+        for location, file_name in sources:
+            source_file = downstream_pkg_dir / file_name
+            if not source_file.exists() or not source_file.is_file():
+                log.secho(f"Source file is not available: {file_name}")
+                new_sources = None
+                break
+            new_sources.append(file_name)
+
+        if not new_sources:
+            return False
+
+        # Only upload the sources that are not already in the `sources` file
+        sources_file = downstream_pkg_dir / "sources"
+        uploaded = read_sources_file(sources_file)
+        with runner.span(log, "hash-sources"):
+            hashes = sha512_files(
+                [downstream_pkg_dir / file_name for file_name in new_sources]
+            )
+        changed_sources = [
+            file_name
+            for file_name in new_sources
+            if uploaded.get(file_name)
+            != ("sha512", hashes[downstream_pkg_dir / file_name])
+        ]
+        stale_sources = set(uploaded) - set(new_sources)
+
+        if changed_sources:
+            new_sources_msg = (
+                f"Uploading the following sources for {pkg} to fedora:\n"
+                + "\n".join(changed_sources)
+            )
+            # Cannot make a prompt when using the stdin to read the packages
+            # https://github.com/pallets/click/issues/1370
+            if not pacakges_from_stdin and not log.confirm(new_sources_msg):
+                return False
+        else:
+            log.echo(f"Sources of {pkg} are already uploaded.")
+
+        # `fedpkg upload` keeps the other entries and only skips the exact
+        # duplicates, so drop the ones that are no longer used and the old
+        # entries of the changed sources
+        dropped_sources = stale_sources | (set(changed_sources) & set(uploaded))
+        if dropped_sources:
+            sources_file.write_text(
+                "".join(
+                    line
+                    for line in sources_file.read_text().splitlines(keepends=True)
+                    if (entry := parse_sources_line(line)) is None
+                    or entry[0] not in dropped_sources
+                )
+            )
+        if changed_sources:
+            runner.run(
+                log,
+                "new-sources",
+                ["fedpkg", "upload", *changed_sources],
+                cwd=downstream_pkg_dir,
+                bytes_transferred=sum(
+                    (downstream_pkg_dir / file_name).stat().st_size
+                    for file_name in changed_sources
+                ),
+            )
+        return True
+
+    def process_pkg(pkg: str, log: PkgLog) -> str:
+        """Process a package, returning its status."""
         pkg_dir = workdir / pkg
         if not pkg_dir.exists():
-            click.secho(f"{pkg_dir} does not exist", fg="orange")
-            return
-        click.echo(f"Processing {pkg}.")
+            log.secho(f"{pkg_dir} does not exist", fg="yellow")
+            return "missing"
+        # The manifest is only used by the incremental runs
+        content_hash = manifest.hash_dir(pkg_dir) if incremental else None
+        if content_hash and manifest.is_unchanged(pkg, content_hash):
+            log.secho(f"Skipping {pkg}: unchanged since last push", fg="bright_black")
+            return "unchanged"
+        done = journal.done(pkg)
+        if "done" in done:
+            status = done["done"]["status"]
+            log.secho(f"Skipping {pkg}: already {status}", fg="bright_black")
+            return status
+        if done:
+            log.echo(f"Resuming {pkg} after {', '.join(done)}.")
+        else:
+            log.echo(f"Processing {pkg}.")
         pkg_spec = f"{pkg}.spec"
         downstream_pkg_dir = downstream_dir / pkg
-        if not downstream_pkg_dir.exists():
-            subprocess.run(
-                ["fedpkg", "clone", pkg],
-                cwd=downstream_dir,
-                check=True,
+        if "cloned" not in done:
+            if not downstream_pkg_dir.exists():
+                clone_args = ["fedpkg", "clone", pkg]
+                if git_cache:
+                    # Refreshing the mirror is network-bound as well
+                    with runner.network_limit:
+                        clone_args = git_cache.clone_args(pkg)
+                runner.run(log, "clone", clone_args, cwd=downstream_dir)
+            journal.record(pkg, "cloned")
+        if "synced" not in done:
+            runner.run(log, "fork", ["fedpkg", "fork"], cwd=downstream_pkg_dir)
+            runner.run(
+                log,
+                "switch-branch",
+                ["fedpkg", "switch-branch", "rawhide"],
+                cwd=downstream_pkg_dir,
             )
-        subprocess.run(
-            ["fedpkg", "fork"],
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        subprocess.run(
-            ["fedpkg", "switch-branch", "rawhide"],
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        subprocess.run(
-            ["fedpkg", "pull"],
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        subprocess.run(
-            ["rsync", *rsync_args, f"{pkg_dir}/", f"{downstream_pkg_dir}/"],
-            check=True,
-        )
-        res = subprocess.run(
-            ["rpmspec", "--srpm", "-q", r"--queryformat=%{version}", pkg_spec],
-            capture_output=True,
-            text=True,
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        version = res.stdout.rstrip()
+            runner.run(log, "pull", ["fedpkg", "pull"], cwd=downstream_pkg_dir)
+            runner.run(
+                log,
+                "rsync",
+                ["rsync", *rsync_args, f"{pkg_dir}/", f"{downstream_pkg_dir}/"],
+            )
+            journal.record(pkg, "synced")
+        with runner.span(log, "spec"):
+            spec = SpecModel(downstream_pkg_dir / pkg_spec)
+            version = spec.version
         pkg_rhbz_msg = ""
         pkg_commit_msg = commit_msg.format(
             pkg=pkg,
@@ -187,81 +913,93 @@ def main(
             pkg=pkg,
             version=version,
         )
-        subprocess.run(
-            ["rpmdev-bumpspec", pkg_spec, "-c", commit_msg],
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        subprocess.run(
-            ["spectool", "-S", "-g", pkg_spec],
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        res = subprocess.run(
-            ["spectool", "-S", "-l", pkg_spec],
-            capture_output=True,
-            text=True,
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        new_sources = []
-        for src_txt in res.stdout.rstrip().splitlines():
-            match = SOURCE_RE.match(src_txt)
-            if not match:
-                click.secho(f"Unexpected source url format: {src_txt}", fg="red")
-                new_sources = None
-                break
-            file_name = match.group("file")
-            source_file = downstream_pkg_dir / file_name
-            if not source_file.exists() or not source_file.is_file():
-                click.secho(f"Source file is not available: {file_name}")
-                new_sources = None
-                break
-            new_sources.append(file_name)
+        if "bumped" not in done:
+            # Never bump the same package twice, the run may have been
+            # interrupted right after the spec file was saved
+            if spec.evr != done.get("bumping", {}).get("evr"):
+                with runner.span(log, "bumpspec"):
+                    spec.bump(pkg_commit_msg)
+                    # Recorded before the spec file is saved
+                    journal.record(pkg, "bumping", evr=spec.evr)
+                    spec.save()
+            journal.record(pkg, "bumped", evr=spec.evr)
+        sources = spec.sources()
+        if "uploaded" not in done:
+            if not upload_sources(pkg, log, downstream_pkg_dir, sources):
+                log.secho(f"Skipping {pkg}", fg="bright_black")
+                return "skipped"
+            journal.record(pkg, "uploaded")
+        if "committed" not in done:
+            runner.run(log, "git-add", ["git", "add", "-A"], cwd=downstream_pkg_dir)
+            runner.run(
+                log,
+                "git-checkout",
+                # The branch may be left over by the interrupted run
+                ["git", "checkout", "-B" if done else "-b", pkg_branch],
+                cwd=downstream_pkg_dir,
+            )
+            res = runner.run(
+                log,
+                "commit",
+                ["git", "commit", "-m", pkg_commit_msg],
+                cwd=downstream_pkg_dir,
+                check=False,
+            )
+            if res.returncode:
+                log.secho("Nothing commited", fg="bright_black")
+                return "unchanged"
+            journal.record(pkg, "committed")
+        runner.run(log, "push", ["git", "push", fas_id], cwd=downstream_pkg_dir)
+        if content_hash:
+            manifest.record(pkg, content_hash)
+        return "pushed"
 
-        if not new_sources:
-            click.secho(f"Skipping {pkg}", fg="grey")
-            return
+    def process_pkg_logged(pkg: str) -> bool:
+        # The output of the stages must not go in the middle of the records
+        log = PkgLog(pkg, buffered=jobs > 1 or json_lines, err=json_lines)
+        status = "failed"
+        try:
+            status = process_pkg(pkg, log)
+            # Skipped packages are retried, e.g. once their sources are fixed
+            if status != "skipped" and "done" not in journal.done(pkg):
+                journal.record(pkg, "done", status=status)
+        except (
+            SystemExit,
+            subprocess.CalledProcessError,
+            OSError,
+            SpecfileException,
+        ) as exc:
+            if not isinstance(exc, (SystemExit, subprocess.CalledProcessError)):
+                log.secho(str(exc), fg="red")
+            log.secho(f"Failed to process {pkg}", fg="red")
+            return False
+        finally:
+            log.flush()
+            out.emit(pkg, "update", status=status)
+        return True
 
-        new_sources_msg = (
-            f"Uploading the following sources for {pkg} to fedora:\n"
-            + "\n".join(new_sources)
-        )
-        # Cannot make a prompt when using the stdin to read the packages
-        # https://github.com/pallets/click/issues/1370
-        if not pacakges_from_stdin and not click.confirm(new_sources_msg):
-            click.secho(f"Skipping {pkg}", fg="grey")
-            return
+    failed = []
+    if jobs > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            # The packages are submitted as soon as they are read
+            futures = {
+                pkg: executor.submit(process_pkg_logged, pkg) for pkg in packages
+            }
+        failed = [pkg for pkg, future in futures.items() if not future.result()]
+    else:
+        for pkg in packages:
+            if not process_pkg_logged(pkg):
+                failed.append(pkg)
 
-        subprocess.run(
-            ["fedpkg", "new-sources", *new_sources],
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        subprocess.run(
-            ["git", "add", "-A"],
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        subprocess.run(
-            ["git", "checkout", "-b", pkg_branch],
-            cwd=downstream_pkg_dir,
-            check=True,
-        )
-        res = subprocess.run(
-            ["git", "commit", "-m", pkg_commit_msg],
-            cwd=downstream_pkg_dir,
-        )
-        if res.returncode:
-            click.secho("Nothing commited", fg="gray")
-            return
-        subprocess.run(["git", "push", fas_id], cwd=downstream_pkg_dir, check=True)
+    if failed:
+        out.echo(f"Failed to process {len(failed)} packages:", fg="red")
+        for pkg in failed:
+            out.echo(f"  {pkg}", fg="red")
 
-    for pkg in packages:
-        try:
-            process_pkg(pkg)
-        except (SystemExit, subprocess.CalledProcessError):
-            click.secho(f"Failed to process {pkg}", fg="red")
+    journal.close()
+    if tracer:
+        tracer.close()
+        tracer.summary(err=json_lines)
 
 
 if __name__ == "__main__":
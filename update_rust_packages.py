@@ -5,16 +5,184 @@
 # ///
 from __future__ import annotations
 
+import concurrent.futures
+import json
+import os
+import re
 import subprocess
+import tarfile
+import threading
 import tomllib
 from pathlib import Path
 import sys
 
 import click
 
+from pipeline import RecordWriter, read_packages
+
+# Constants
+CRATE_DEP_RE = re.compile(r"crate\((?P<crate>[^/)]+)")
+SPEC_VERSION_RE = re.compile(r"^Version:\s*(?P<version>\S+)", re.MULTILINE)
+SPEC_CRATE_RE = re.compile(r"^%global\s+crate\s+(?P<crate>\S+)", re.MULTILINE)
+SEMVER_RE = re.compile(r"(?P<release>\d+(\.\d+)*)(-(?P<pre>[^+]+))?(\+.*)?")
+
 # Variables for the lazy
 # You can add them manually here instead of passing via CLI
 packages = []
+jobs = 1
+crate_cache = None
+crate_index = None
+json_lines = False
+
+
+def read_cargo_toml(pkg_dir: Path) -> dict | None:
+    """Read the `Cargo.toml` of the latest crate stored in the package dir."""
+    crates = sorted(pkg_dir.glob("*.crate"), key=lambda f: f.stat().st_mtime)
+    if not crates:
+        return None
+    with tarfile.open(crates[-1], "r:gz") as tar:
+        for member in tar:
+            # The crate contents are under a `{name}-{version}` directory
+            if member.name.count("/") == 1 and member.name.endswith("/Cargo.toml"):
+                with tar.extractfile(member) as f:
+                    return tomllib.load(f)
+    return None
+
+
+def get_crate_deps(pkg_dir: Path, pkg: str) -> set[str]:
+    """
+    Get the crates that a package depends on.
+
+    The crate's `Cargo.toml` is used if available, otherwise the `crate(...)`
+    dependencies of the spec file. Dev-dependencies are not considered since
+    they commonly form cycles.
+    """
+    cargo_toml = read_cargo_toml(pkg_dir)
+    if cargo_toml is not None:
+        tables = [cargo_toml]
+        tables.extend(cargo_toml.get("target", {}).values())
+        deps = set()
+        for table in tables:
+            for key in ("dependencies", "build-dependencies"):
+                for name, dep in table.get(key, {}).items():
+                    if isinstance(dep, dict):
+                        name = dep.get("package", name)
+                    deps.add(name)
+        return deps
+    spec_file = pkg_dir / f"{pkg}.spec"
+    if not spec_file.exists():
+        return set()
+    deps = set()
+    for line in spec_file.read_text().splitlines():
+        if line.startswith(("BuildRequires:", "Requires:")):
+            deps.update(CRATE_DEP_RE.findall(line))
+    return deps
+
+
+def dependency_waves(
+    deps: dict[str, set[str]], out: RecordWriter
+) -> list[list[str]]:
+    """
+    Group the packages in waves where each wave only depends on previous ones.
+
+    If there is a dependency cycle, the packages with the fewest pending
+    dependencies are scheduled first.
+    """
+    remaining = {pkg: set(pkg_deps) for pkg, pkg_deps in deps.items()}
+    waves = []
+    while remaining:
+        wave = [pkg for pkg, pkg_deps in remaining.items() if not pkg_deps]
+        if not wave:
+            min_deps = min(len(pkg_deps) for pkg_deps in remaining.values())
+            wave = [
+                pkg for pkg, pkg_deps in remaining.items() if len(pkg_deps) == min_deps
+            ]
+            out.echo(f"Dependency cycle detected, running: {wave}", fg="yellow")
+        waves.append(wave)
+        for pkg in wave:
+            del remaining[pkg]
+        for pkg_deps in remaining.values():
+            pkg_deps.difference_update(wave)
+    return waves
+
+
+def read_spec_version(pkg_dir: Path, pkg: str) -> tuple[str, str | None]:
+    """
+    Get the crate and the current version of a package from its spec file,
+    without expanding its macros. The version is `None` if it is unknown.
+    """
+    spec_file = pkg_dir / f"{pkg}.spec"
+    if not spec_file.exists():
+        return pkg.removeprefix("rust-"), None
+    spec = spec_file.read_text()
+    crate_match = SPEC_CRATE_RE.search(spec)
+    crate = crate_match["crate"] if crate_match else pkg.removeprefix("rust-")
+    version_match = SPEC_VERSION_RE.search(spec)
+    if not version_match or "%" in version_match["version"]:
+        return crate, None
+    # Pre-releases are written with a tilde in the spec files
+    return crate, version_match["version"].replace("~", "-")
+
+
+def version_key(version: str) -> tuple | None:
+    """Key of a semantic version to compare it, `None` if it is not one."""
+    match = SEMVER_RE.fullmatch(version)
+    if not match:
+        return None
+    release = tuple(int(part) for part in match["release"].split("."))
+    if match["pre"] is None:
+        return release, 1, ()
+    # Numeric identifiers have a lower precedence than the alphanumeric ones
+    pre = tuple(
+        (0, int(part), "") if part.isdigit() else (1, 0, part)
+        for part in match["pre"].split(".")
+    )
+    return release, 0, pre
+
+
+def crate_index_file(index_dir: Path, crate: str) -> Path:
+    """Path of a crate in a crates.io index, with the layout of the sparse index."""
+    name = crate.lower()
+    if len(name) <= 2:
+        return index_dir / str(len(name)) / name
+    if len(name) == 3:
+        return index_dir / "3" / name[0] / name
+    return index_dir / name[:2] / name[2:4] / name
+
+
+def latest_crate_version(index_dir: Path, crate: str) -> str | None:
+    """Get the latest version of a crate that is neither yanked nor a pre-release."""
+    index_file = crate_index_file(index_dir, crate)
+    if not index_file.exists():
+        return None
+    latest = None
+    latest_key = None
+    with index_file.open("r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            release = json.loads(line)
+            if release.get("yanked"):
+                continue
+            key = version_key(release["vers"])
+            if key is None or key[1] == 0:
+                continue
+            if latest_key is None or key > latest_key:
+                latest, latest_key = release["vers"], key
+    return latest
+
+
+def get_rust2rpm_args(pkg_dir: Path, rust2rpm_args: list[str]) -> list[str]:
+    pkg_rust2rpm_args = rust2rpm_args.copy()
+    rust2rpm_toml = pkg_dir / "rust2rpm.toml"
+    if rust2rpm_toml.exists():
+        with rust2rpm_toml.open("rb") as f:
+            rust2rpm_data = tomllib.load(f)
+            if (
+                rust2rpm_package := rust2rpm_data.get("package")
+            ) and "cargo-toml-patch-comments" in rust2rpm_package:
+                pkg_rust2rpm_args.append("-r")
+    return pkg_rust2rpm_args
 
 
 @click.command()
@@ -42,39 +210,145 @@ packages = []
     """,
     default=None,
 )
-def main(packages_file, workdir: Path, bump_version: str | None):
+@click.option(
+    "--jobs",
+    "-j",
+    help="""
+    Number of rust2rpm to run in parallel. The packages are run in waves
+    following their dependencies within the list of packages.
+    """,
+    default=jobs,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--crate-cache",
+    help="""
+    Cache directory shared by all the rust2rpm runs (set as `XDG_CACHE_HOME`).
+    By default the user's rust2rpm cache is used.
+    """,
+    default=crate_cache,
+    type=click.Path(file_okay=False, path_type=Path),
+)
+@click.option(
+    "--crate-index",
+    help="""
+    Local snapshot of the crates.io index, e.g. a clone of
+    https://github.com/rust-lang/crates.io-index or a directory with the same
+    layout. rust2rpm is then only run on the packages with a newer version of
+    their crate, or not at the `--bump-version` yet.
+    """,
+    default=crate_index,
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+)
+@click.option(
+    "--json-lines/--no-json-lines",
+    help="""
+    Write the result of each package as a JSON-lines record.
+    """,
+    default=json_lines,
+)
+def main(
+    packages_file,
+    workdir: Path,
+    bump_version: str | None,
+    jobs: int,
+    crate_cache: Path | None,
+    crate_index: Path | None,
+    json_lines: bool,
+):
     global packages
 
-    if packages_file == "-":
-        if not sys.stdin.isatty():
-            packages = []
-            for pkg in sys.stdin:
-                packages.append(pkg.rstrip())
-    else:
-        with Path(packages_file).open("r") as f:
-            packages = f.read().rstrip().split("\n")
+    packages = read_packages(packages_file, packages)
+    out = RecordWriter(json_lines)
 
     rust2rpm_args = ["-s"]
     if bump_version:
         rust2rpm_args.append(f"@{bump_version}")
 
-    # First pass prepare the main packages
-    for pkg in packages:
-        pkg_rust2rpm_args = rust2rpm_args.copy()
+    env = None
+    if crate_cache:
+        env = {**os.environ, "XDG_CACHE_HOME": str(crate_cache)}
+
+    output_lock = threading.Lock()
+    # rust2rpm must not write in the middle of the records
+    stdout = sys.stderr if json_lines else None
+
+    def run_rust2rpm(pkg: str, capture_output: bool = False) -> None:
         pkg_dir = workdir / pkg
-        rust2rpm_toml = pkg_dir / "rust2rpm.toml"
-        if rust2rpm_toml.exists():
-            with rust2rpm_toml.open("rb") as f:
-                rust2rpm_data = tomllib.load(f)
-                if (
-                    rust2rpm_package := rust2rpm_data.get("package")
-                ) and "cargo-toml-patch-comments" in rust2rpm_package:
-                    pkg_rust2rpm_args.append("-r")
-        ret = subprocess.run(["rust2rpm", *pkg_rust2rpm_args], cwd=pkg_dir)
-        if not ret.returncode:
-            click.secho(f"rust2rpm update on {pkg}: Successful", fg="green")
+        pkg_rust2rpm_args = get_rust2rpm_args(pkg_dir, rust2rpm_args)
+        ret = subprocess.run(
+            ["rust2rpm", *pkg_rust2rpm_args],
+            cwd=pkg_dir,
+            env=env,
+            text=True,
+            stdout=subprocess.PIPE if capture_output else stdout,
+            stderr=subprocess.STDOUT if capture_output else None,
+        )
+        with output_lock:
+            if capture_output and ret.stdout:
+                out.echo(f"==> {pkg}", bold=True)
+                out.echo(ret.stdout.rstrip())
+            if not ret.returncode:
+                out.echo(f"rust2rpm update on {pkg}: Successful", fg="green")
+            else:
+                out.echo(f"rust2rpm update on {pkg}: failed", fg="red")
+        out.emit(
+            pkg,
+            "rust2rpm",
+            status="failed" if ret.returncode else "succeeded",
+            returncode=ret.returncode,
+        )
+
+    skipped = []
+
+    def needs_update(pkg: str) -> bool:
+        crate, version = read_spec_version(workdir / pkg, pkg)
+        if bump_version:
+            target = bump_version.replace("~", "-")
+            up_to_date = version == target
         else:
-            click.secho(f"rust2rpm update on {pkg}: failed", fg="red")
+            target = latest_crate_version(crate_index, crate)
+            current_key = version and version_key(version)
+            target_key = target and version_key(target)
+            # rust2rpm is run if any of the versions is unknown
+            up_to_date = bool(current_key and target_key) and target_key <= current_key
+        if not up_to_date:
+            return True
+        skipped.append(pkg)
+        out.echo(f"Skipping {pkg}: {version} is up to date", fg="bright_black")
+        out.emit(pkg, "rust2rpm", status="skipped", version=version)
+        return False
+
+    def report_skipped() -> None:
+        if skipped:
+            out.echo(f"Skipped {len(skipped)} packages already up to date")
+
+    if crate_index:
+        # The versions are checked as the packages are read
+        packages = filter(needs_update, packages)
+
+    if jobs == 1:
+        # Each package is updated as soon as it is read
+        for pkg in packages:
+            run_rust2rpm(pkg)
+        report_skipped()
+        return
+
+    # The waves need all the packages
+    packages = list(packages)
+    # Only the dependencies within the packages being updated matter
+    crate_pkgs = {pkg.removeprefix("rust-"): pkg for pkg in packages}
+    deps = {}
+    for pkg in packages:
+        pkg_crate_deps = get_crate_deps(workdir / pkg, pkg)
+        deps[pkg] = {
+            crate_pkgs[crate] for crate in pkg_crate_deps if crate in crate_pkgs
+        } - {pkg}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for wave in dependency_waves(deps, out):
+            # Wait for the whole wave before starting the next one
+            list(executor.map(lambda pkg: run_rust2rpm(pkg, True), wave))
+    report_skipped()
 
 
 if __name__ == "__main__":